@@ -0,0 +1,46 @@
+import json
+import logging
+import os
+from typing import Any, Optional
+
+from slugify import slugify
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileCache:
+    """Small JSON file store used to persist state between restarts"""
+
+    def __init__(self, directory: Optional[str]) -> None:
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{slugify(key, separator='_')}.json")
+
+    def load(self, key: str) -> Optional[Any]:
+        if not self.directory:
+            return None
+
+        try:
+            with open(self.path(key)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as error:
+            logger.warning(f"Could not read cache {key}: {error}")
+            return None
+
+    def save(self, key: str, data: Any) -> None:
+        if not self.directory:
+            return
+
+        path = self.path(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so a crash never leaves a partial file
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(data, file)
+            os.replace(f"{path}.tmp", path)
+        except OSError as error:
+            logger.warning(f"Could not write cache {key}: {error}")
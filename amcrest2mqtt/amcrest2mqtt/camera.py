@@ -1,16 +1,53 @@
+import asyncio
 import logging
 import sys
-from functools import cached_property
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Optional, TypeVar
 
-from amcrest import AmcrestCamera
+from amcrest import AmcrestCamera, AmcrestError
 from slugify import slugify
 
+from amcrest2mqtt.cache import FileCache
+from amcrest2mqtt.metrics import Metrics
+
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+@dataclass
+class CameraDetails:
+    serial_number: str
+    version: str
+    build_version: str
+    name: str
+    device_type: str
+
+
+def _cached_details(cached: Any) -> CameraDetails:
+    """Rebuild camera details from the cache, raising TypeError if they don't fit"""
+    details = CameraDetails(**cached)
+    if not all(isinstance(value, str) for value in asdict(details).values()):
+        raise TypeError("cached camera details must be strings")
+    return details
+
 
 class CameraClient:
-    def __init__(self, host: str, port: str, username: str, password: str) -> None:
+    def __init__(
+        self,
+        host: str,
+        port: str,
+        username: str,
+        password: str,
+        timeout: float = 30,
+        max_workers: int = 2,
+        executor: Optional[Executor] = None,
+        metrics: Optional[Metrics] = None,
+        limit: Optional[asyncio.Semaphore] = None,
+    ) -> None:
 
         if not host:
             logger.error("Please set the AMCREST_HOST environment variable")
@@ -20,53 +57,203 @@ class CameraClient:
             logger.error("Please set the AMCREST_PASSWORD environment variable")
             sys.exit(1)
 
+        self.host = host
+        self.timeout = timeout
+        self.details: Optional[CameraDetails] = None
+        self.metrics = metrics
+
+        # python-amcrest is synchronous, so calls are run on a small pool (shared
+        # between cameras when supervising several) and bounded by a semaphore to
+        # avoid stacking requests on a slow camera. Pass `limit` to keep the bound
+        # across clients for the same camera, as threads may outlive a client.
+        self._executor = executor or ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"amcrest_{host}"
+        )
+        self._semaphore = limit or asyncio.Semaphore(max_workers)
+
         # Connect to camera
         self.client = AmcrestCamera(host, port, username, password).camera
 
-        # Fetch camera details
-        logger.info("Fetching camera details...")
+    async def run(
+        self,
+        func: Callable[..., T],
+        *args: Any,
+        timeout: Optional[float] = None,
+        name: Optional[str] = None,
+    ) -> T:
+        """Run a blocking camera call in the executor without blocking the event loop
+
+        Raises AmcrestError if the call does not complete within `timeout` seconds,
+        including any wait for a worker held by other calls. `name` identifies the
+        call in errors and metrics, defaulting to its __name__.
+
+        A call which timed out keeps its worker until its thread returns, so a hung
+        camera can't take more than its share of a shared executor.
+        """
+        timeout = timeout or self.timeout
+        name = name or getattr(func, "__name__", repr(func))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError as error:
+            raise AmcrestError(
+                f"Camera call {name} timed out after {timeout}s waiting for a worker"
+            ) from error
+
+        started = time.monotonic()
+        timed_out = False
+        try:
+            future = loop.run_in_executor(self._executor, func, *args)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        def done(future: asyncio.Future) -> None:
+            self._semaphore.release()
+            if self.metrics is not None:
+                self.metrics.camera_call_duration.observe(
+                    time.monotonic() - started, self.host, name
+                )
+                # Calls which timed out were counted as errors already
+                if not (timed_out or future.cancelled() or future.exception() is None):
+                    self.metrics.camera_call_errors.inc(self.host, name)
+
+        future.add_done_callback(done)
+        try:
+            # Shielded, as cancelling it would only hand the worker back early
+            return await asyncio.wait_for(
+                asyncio.shield(future), max(deadline - loop.time(), 0)
+            )
+        except asyncio.TimeoutError as error:
+            timed_out = True
+            if self.metrics is not None:
+                self.metrics.camera_call_errors.inc(self.host, name)
+            raise AmcrestError(
+                f"Camera call {name} timed out after {timeout}s"
+            ) from error
+
+    async def probe(self, timeout: float) -> None:
+        """Check the camera answers a cheap HTTP call, raises AmcrestError if not
+
+        Made over async HTTP like the event stream rather than through run, so a
+        camera busy with slow calls holding its workers still answers in time.
+        """
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                self.client.async_command(
+                    "global.cgi?action=getCurrentTime", retries=0, timeout_cmd=timeout
+                ),
+                timeout,
+            )
+        except (AmcrestError, asyncio.TimeoutError) as error:
+            if self.metrics is not None:
+                self.metrics.camera_call_errors.inc(self.host, "probe")
+            if isinstance(error, AmcrestError):
+                raise
+            raise AmcrestError(
+                f"Camera call probe timed out after {timeout}s"
+            ) from error
+        finally:
+            if self.metrics is not None:
+                self.metrics.camera_call_duration.observe(
+                    time.monotonic() - started, self.host, "probe"
+                )
+
+    async def load_details(self, cache: Optional[FileCache] = None) -> bool:
+        """Load camera details from the cache, or fetch them from the camera
+
+        Returns True if cached details were used, in which case they should be
+        refreshed in the background with refresh_details.
+        """
+        cached = cache.load(f"details_{self.host}") if cache else None
+        if cached:
+            try:
+                self.details = _cached_details(cached)
+                logger.info(f"Using cached camera details for {self.host}")
+            except (TypeError, ValueError) as error:
+                # Written by another version, or damaged
+                logger.warning(f"Ignoring cached details for {self.host}: {error}")
+                cached = None
+        if not cached:
+            logger.info("Fetching camera details...")
+            await self.refresh_details(cache)
+
         logger.info(f"Device type: {self.device_type}")
         logger.info(f"Serial number: {self.serial_number}")
         logger.info(f"Software version: {self.amcrest_version}")
         logger.info(f"Device name: {self.name}")
 
-    @cached_property
+        return cached is not None
+
+    async def refresh_details(self, cache: Optional[FileCache] = None) -> bool:
+        """Fetch camera details concurrently, returns True if they changed"""
+        serial_number, software_information, machine_name, device_type = (
+            await asyncio.gather(
+                self.run(lambda: self.client.serial_number, name="serial_number"),
+                self.run(
+                    lambda: self.client.software_information,
+                    name="software_information",
+                ),
+                self.run(lambda: self.client.machine_name, name="machine_name"),
+                self.run(lambda: self.client.device_type, name="device_type"),
+            )
+        )
+
+        details = CameraDetails(
+            serial_number=serial_number,
+            version=software_information[0].replace("version=", "").strip(),
+            build_version=software_information[1].strip(),
+            name=machine_name.replace("name=", "").strip(),
+            device_type=device_type.replace("type=", "").strip(),
+        )
+
+        changed = details != self.details
+        self.details = details
+        if changed and cache:
+            cache.save(f"details_{self.host}", asdict(details))
+
+        return changed
+
+    @property
     def serial_number(self) -> str:
         """Get serial number from Amcrest camera"""
-        return self.client.serial_number
+        return self.details.serial_number
 
-    @cached_property
+    @property
     def version(self) -> str:
-        return self.client.software_information[0].replace("version=", "").strip()
+        return self.details.version
 
-    @cached_property
+    @property
     def name(self) -> str:
-        return self.client.machine_name.replace("name=", "").strip()
+        return self.details.name
 
-    @cached_property
+    @property
     def device_slug(self) -> str:
         return slugify(self.name, separator="_")
 
-    @cached_property
+    @property
     def build_version(self) -> str:
-        return self.client.software_information[1].strip()
+        return self.details.build_version
 
-    @cached_property
+    @property
     def amcrest_version(self) -> str:
         return f"{self.version} ({self.build_version})"
 
-    @cached_property
+    @property
     def device_type(self) -> str:
-        return self.client.device_type.replace("type=", "").strip()
+        return self.details.device_type
 
-    @cached_property
+    @property
     def is_ad410(self) -> bool:
         return self.device_type == "AD410"
 
-    @cached_property
+    @property
     def is_ad110(self) -> bool:
         return self.device_type == "AD110"
 
-    @cached_property
+    @property
     def is_doorbell(self) -> bool:
         return self.is_ad410 or self.is_ad110
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from amcrest import AmcrestError
+from paho.mqtt.client import MQTTMessage
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.mqtt import MqttClient
+from amcrest2mqtt.snapshot import SnapshotFetcher
+from amcrest2mqtt.topics import Topics
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CommandDevice:
+    """A device commands are run on"""
+
+    camera: CameraClient
+    topics: Topics
+    snapshots: Optional[SnapshotFetcher] = None
+
+
+# Runs a command on the device with the payload it was sent, returning its result.
+# Blocking commands are run on the camera's executor, others are awaited.
+CommandFunction = Callable[[CommandDevice, str], Any]
+
+
+@dataclass(frozen=True)
+class CommandSpec:
+    name: str
+    run: CommandFunction
+    blocking: bool = True
+
+
+COMMANDS: Dict[str, CommandSpec] = {}
+
+
+def camera_command(
+    name: str, blocking: bool = True
+) -> Callable[[CommandFunction], CommandFunction]:
+    """Register a command run by publishing to `amcrest2mqtt/{serial}/command/{name}`
+
+    The payload of the message is passed to the command as text. Commands which
+    don't block are coroutine functions, run on the event loop.
+    """
+
+    def decorator(run: CommandFunction) -> CommandFunction:
+        COMMANDS[name] = CommandSpec(name, run, blocking)
+        return run
+
+    return decorator
+
+
+@dataclass
+class _Command:
+    device: CommandDevice
+    spec: CommandSpec
+    payload: str
+    # Correlation data of each request merged into this command, None when the
+    # request had none
+    requests: List[Optional[bytes]] = field(default_factory=list)
+
+
+class CommandDispatcher:
+    """Runs commands received over MQTT on a bounded pool of workers
+
+    Messages are handed from the MQTT client to the event loop and queued, then run
+    by one of `workers` tasks on the executor of their camera, so commands never
+    hold up the event loop or the events being forwarded. A full queue rejects
+    commands rather than growing.
+
+    A command repeated with the same payload while queued or running is merged
+    into it. Its result is published to `amcrest2mqtt/{serial}/response/{name}`,
+    once for each request with its MQTT v5 correlation data.
+    """
+
+    def __init__(
+        self,
+        mqtt_client: MqttClient,
+        workers: int = 2,
+        queue_size: int = 100,
+        commands: Optional[Dict[str, CommandSpec]] = None,
+    ) -> None:
+        self.mqtt_client = mqtt_client
+        self.workers = workers
+        self.commands = COMMANDS if commands is None else commands
+        self._loop = asyncio.get_event_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+        # Queued or running commands, by camera host, name and payload
+        self._active: Dict[Tuple[str, str, str], _Command] = {}
+
+    def add_device(
+        self,
+        camera: CameraClient,
+        topics: Topics,
+        snapshots: Optional[SnapshotFetcher] = None,
+    ) -> None:
+        """Accept commands for a device, with the snapshots it fetches if given"""
+        device = CommandDevice(camera, topics, snapshots)
+
+        def handle(message: MQTTMessage) -> None:
+            self._loop.call_soon_threadsafe(self._receive, device, message)
+
+        self.mqtt_client.subscribe(f"{topics.command}/+", handle)
+
+    def remove_device(self, topics: Topics) -> None:
+        self.mqtt_client.unsubscribe(f"{topics.command}/+")
+
+    async def run(self) -> None:
+        tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _receive(self, device: CommandDevice, message: MQTTMessage) -> None:
+        camera, topics = device.camera, device.topics
+        name = message.topic.rsplit("/", 1)[-1]
+        payload = message.payload.decode(errors="replace")
+        correlation_data = getattr(message.properties, "CorrelationData", None)
+
+        # Sent again on every subscription, a retained reboot would loop forever
+        if message.retain:
+            logger.warning(f"Ignoring retained {name} command for {camera.host}")
+            self._respond(
+                topics, name, [correlation_data], error="Retained commands are ignored"
+            )
+            return
+
+        spec = self.commands.get(name)
+        if spec is None:
+            self._respond(topics, name, [correlation_data], error="Unknown command")
+            return
+
+        key = (camera.host, name, payload)
+        command = self._active.get(key)
+        if command is not None:
+            logger.debug(f"Merging repeated {name} command for {camera.host}")
+            command.requests.append(correlation_data)
+            return
+
+        command = _Command(device, spec, payload, [correlation_data])
+        try:
+            self._queue.put_nowait(command)
+        except asyncio.QueueFull:
+            logger.warning(f"Command queue full, rejecting {name} for {camera.host}")
+            self._respond(topics, name, command.requests, error="Too many commands")
+            return
+        self._active[key] = command
+
+    async def _work(self) -> None:
+        while True:
+            command = await self._queue.get()
+            await self._execute(command)
+
+    async def _execute(self, command: _Command) -> None:
+        device, spec = command.device, command.spec
+        camera = device.camera
+        logger.info(f"Running {spec.name} command on {camera.host}")
+        result, error = None, None
+        try:
+            if spec.blocking:
+                result = await camera.run(
+                    spec.run, device, command.payload, name=f"command_{spec.name}"
+                )
+            else:
+                result = await spec.run(device, command.payload)
+        except (AmcrestError, ValueError) as command_error:
+            logger.warning(
+                f"Error running {spec.name} on {camera.host}: {command_error}"
+            )
+            error = str(command_error)
+        except Exception as command_error:
+            logger.exception(f"Unexpected error running {spec.name} on {camera.host}")
+            error = str(command_error)
+        finally:
+            # Repeats from now on run the command again
+            self._active.pop((camera.host, spec.name, command.payload), None)
+
+        self._respond(device.topics, spec.name, command.requests, result, error)
+
+    def _respond(
+        self,
+        topics: Topics,
+        name: str,
+        requests: List[Optional[bytes]],
+        result: Any = None,
+        error: Optional[str] = None,
+    ) -> None:
+        response: Dict[str, Any] = {"command": name, "status": "ok"}
+        if error is not None:
+            response = response | {"status": "error", "error": error}
+        elif result is not None:
+            response["result"] = result
+
+        # Requests without correlation data can't tell their responses apart
+        for correlation_data in dict.fromkeys(requests):
+            self.mqtt_client.publish(
+                topic=f"{topics.response}/{name}",
+                payload=response,
+                as_json=True,
+                exit_on_error=False,
+                correlation_data=correlation_data,
+            )
+
+
+def _response_text(response: Any) -> Any:
+    # Setter calls answer with a body of "OK"
+    return response.strip() if isinstance(response, str) else response
+
+
+@camera_command("reboot")
+def reboot(device: CommandDevice, payload: str) -> Any:
+    return _response_text(device.camera.client.reboot())
+
+
+@camera_command("privacy")
+def privacy(device: CommandDevice, payload: str) -> Any:
+    mode = payload.strip().lower()
+    if mode not in ("on", "off"):
+        raise ValueError(f"Privacy mode must be on or off, not {payload!r}")
+    return _response_text(device.camera.client.set_privacy(mode == "on"))
+
+
+@camera_command("snapshot", blocking=False)
+async def snapshot(device: CommandDevice, payload: str) -> Any:
+    """Publish a snapshot to the snapshot topic, the cached one if still fresh"""
+    if device.snapshots is None:
+        raise ValueError("Snapshots are not available")
+    if await device.snapshots.get() is None:
+        raise AmcrestError(f"Could not fetch a snapshot from {device.camera.host}")
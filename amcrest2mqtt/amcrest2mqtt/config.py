@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from amcrest2mqtt.policy import PublishPolicy, policies_from_env
+
+
+logger = logging.getLogger(__name__)
+
+# Binary sensors which can trigger a snapshot when they turn on
+SNAPSHOT_TRIGGER_SENSORS = ("doorbell", "human", "motion")
+
+
+@dataclass
+class DeviceConfig:
+    host: str
+    password: str
+    port: str = "80"
+    username: str = "admin"
+
+
+@dataclass
+class Settings:
+    amcrest_timeout: float
+    amcrest_max_workers: int
+    poll_intervals: Dict[str, float]
+    poll_jitter: float
+    mqtt_host: str
+    mqtt_port: int
+    mqtt_username: Optional[str]
+    mqtt_password: Optional[str]
+    mqtt_tls_enabled: bool
+    mqtt_tls_ca_cert: Optional[str]
+    mqtt_tls_cert: Optional[str]
+    mqtt_tls_key: Optional[str]
+    home_assistant: bool
+    home_assistant_prefix: str
+    device_restart_delay: float
+    device_restart_max_delay: float
+    mqtt_buffer_size: int
+    mqtt_reconnect_min_delay: float
+    mqtt_reconnect_max_delay: float
+    mqtt_transport: str
+    mqtt_max_inflight: int
+    mqtt_version: str
+    publish_policies: Dict[str, PublishPolicy]
+    cache_dir: str
+    off_delays: Dict[str, float]
+    event_codes: Optional[List[str]]
+    event_forward_codes: Optional[List[str]]
+    event_fields: Optional[List[str]]
+    event_encoding: str
+    json_serializer: str
+    spool_path: Optional[str]
+    spool_max_bytes: int
+    spool_max_age: float
+    metrics_port: int
+    event_trace: bool
+    event_record_dir: Optional[str]
+    event_replay: List[str]
+    event_replay_speed: float
+    event_watchdog_interval: float
+    event_watchdog_timeout: float
+    event_resubscribe_after: float
+    snapshots: bool
+    snapshot_triggers: List[str]
+    snapshot_max_concurrent: int
+    snapshot_max_age: float
+    commands: bool
+    command_workers: int
+    command_queue_size: int
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            amcrest_timeout=float(os.getenv("AMCREST_TIMEOUT", 30)),
+            amcrest_max_workers=int(os.getenv("AMCREST_MAX_WORKERS", 2)),
+            poll_intervals={
+                sensor: float(os.getenv(f"{sensor.upper()}_POLL_INTERVAL", 3600))
+                for sensor in ("storage", "storage_health")
+            },
+            poll_jitter=float(os.getenv("POLL_JITTER", 60)),
+            mqtt_host=os.getenv("MQTT_HOST") or "localhost",
+            mqtt_port=int(os.getenv("MQTT_PORT", "1883")),
+            mqtt_username=os.getenv("MQTT_USERNAME"),
+            mqtt_password=os.getenv("MQTT_PASSWORD"),  # can be None
+            mqtt_tls_enabled=os.getenv("MQTT_TLS_ENABLED") == "true",
+            mqtt_tls_ca_cert=os.getenv("MQTT_TLS_CA_CERT"),
+            mqtt_tls_cert=os.getenv("MQTT_TLS_CERT"),
+            mqtt_tls_key=os.getenv("MQTT_TLS_KEY"),
+            home_assistant=os.getenv("HOME_ASSISTANT") == "true",
+            home_assistant_prefix=os.getenv("HOME_ASSISTANT_PREFIX") or "homeassistant",
+            device_restart_delay=float(os.getenv("DEVICE_RESTART_DELAY", 5)),
+            device_restart_max_delay=float(os.getenv("DEVICE_RESTART_MAX_DELAY", 300)),
+            mqtt_buffer_size=int(os.getenv("MQTT_BUFFER_SIZE", 1000)),
+            mqtt_reconnect_min_delay=float(os.getenv("MQTT_RECONNECT_MIN_DELAY", 1)),
+            mqtt_reconnect_max_delay=float(os.getenv("MQTT_RECONNECT_MAX_DELAY", 60)),
+            mqtt_transport=os.getenv("MQTT_TRANSPORT", "thread"),
+            mqtt_max_inflight=int(os.getenv("MQTT_MAX_INFLIGHT", 20)),
+            mqtt_version=os.getenv("MQTT_VERSION", "3.1.1"),
+            publish_policies=policies_from_env(int(os.getenv("MQTT_QOS", "0"))),
+            cache_dir=os.getenv(
+                "CACHE_DIR",
+                os.path.join(os.path.expanduser("~"), ".cache/amcrest2mqtt"),
+            ),
+            off_delays={
+                sensor: float(os.getenv(f"{sensor.upper()}_OFF_DELAY", 0))
+                for sensor in ("motion", "human", "doorbell")
+            },
+            event_codes=_codes(os.getenv("EVENT_CODES")),
+            event_forward_codes=_codes(os.getenv("EVENT_FORWARD_CODES")),
+            event_fields=_fields(os.getenv("EVENT_FIELDS")),
+            event_encoding=os.getenv("EVENT_ENCODING", "json"),
+            json_serializer=os.getenv("JSON_SERIALIZER", "auto"),
+            spool_path=os.getenv("SPOOL_PATH") or None,
+            spool_max_bytes=int(float(os.getenv("SPOOL_MAX_MB", 50)) * 1024 * 1024),
+            spool_max_age=float(os.getenv("SPOOL_MAX_AGE", 24 * 60 * 60)),
+            metrics_port=int(os.getenv("METRICS_PORT") or 0),
+            event_trace=os.getenv("EVENT_TRACE") == "true",
+            event_record_dir=os.getenv("EVENT_RECORD_DIR") or None,
+            event_replay=[
+                path.strip()
+                for path in os.getenv("EVENT_REPLAY", "").split(",")
+                if path.strip()
+            ],
+            event_replay_speed=float(os.getenv("EVENT_REPLAY_SPEED", 1)),
+            event_watchdog_interval=float(os.getenv("EVENT_WATCHDOG_INTERVAL", 10)),
+            event_watchdog_timeout=float(os.getenv("EVENT_WATCHDOG_TIMEOUT", 5)),
+            event_resubscribe_after=float(os.getenv("EVENT_RESUBSCRIBE_AFTER", 600)),
+            snapshots=os.getenv("SNAPSHOTS") == "true",
+            snapshot_triggers=_snapshot_triggers(
+                os.getenv("SNAPSHOT_TRIGGERS", "doorbell,human")
+            ),
+            snapshot_max_concurrent=int(os.getenv("SNAPSHOT_MAX_CONCURRENT", 2)),
+            snapshot_max_age=float(os.getenv("SNAPSHOT_MAX_AGE", 30)),
+            commands=os.getenv("COMMANDS") == "true",
+            command_workers=int(os.getenv("COMMAND_WORKERS", 2)),
+            command_queue_size=int(os.getenv("COMMAND_QUEUE_SIZE", 100)),
+        )
+
+
+def _codes(value: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma separated list of event codes, None or "All" meaning every code"""
+    if not value or value.strip() == "All":
+        return None
+    return sorted({code.strip() for code in value.split(",") if code.strip()})
+
+
+def _fields(value: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma separated list of payload fields, None meaning every field"""
+    if not value:
+        return None
+    return [field.strip() for field in value.split(",") if field.strip()]
+
+
+def _snapshot_triggers(value: str) -> List[str]:
+    """Parse a comma separated list of the binary sensors which trigger a snapshot"""
+    sensors = [sensor.strip() for sensor in value.split(",") if sensor.strip()]
+    unknown = [sensor for sensor in sensors if sensor not in SNAPSHOT_TRIGGER_SENSORS]
+    if unknown:
+        logger.error(
+            f"Unknown SNAPSHOT_TRIGGERS {', '.join(unknown)}, "
+            f"expected {', '.join(SNAPSHOT_TRIGGER_SENSORS)}"
+        )
+        sys.exit(1)
+    return sensors
+
+
+def load_devices() -> List[DeviceConfig]:
+    """Load the devices to bridge
+
+    Devices are read from the JSON list in AMCREST_DEVICES_FILE if set, otherwise a
+    single device is configured from the AMCREST_* environment variables. Entries in
+    the file fall back to AMCREST_PORT, AMCREST_USERNAME and AMCREST_PASSWORD.
+    """
+    port = os.getenv("AMCREST_PORT", "80")
+    username = os.getenv("AMCREST_USERNAME", "admin")
+    password = os.getenv("AMCREST_PASSWORD")
+
+    devices_file = os.getenv("AMCREST_DEVICES_FILE")
+    if devices_file:
+        with open(devices_file) as file:
+            entries = json.load(file)
+    else:
+        entries = [{"host": os.getenv("AMCREST_HOST")}]
+
+    devices = []
+    for entry in entries:
+        device = DeviceConfig(
+            host=entry.get("host"),
+            port=str(entry.get("port", port)),
+            username=entry.get("username", username),
+            password=entry.get("password", password),
+        )
+
+        if not device.host:
+            logger.error("Please set the AMCREST_HOST environment variable")
+            sys.exit(1)
+
+        if not device.password:
+            logger.error(
+                f"Please set the AMCREST_PASSWORD environment variable for {device.host}"
+            )
+            sys.exit(1)
+
+        devices.append(device)
+
+    return devices
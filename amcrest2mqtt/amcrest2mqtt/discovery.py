@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from amcrest2mqtt.cache import FileCache
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.config import Settings
+from amcrest2mqtt.mqtt import MqttMessage
+from amcrest2mqtt.topics import Topics
+
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryStore:
+    """Hashes of the discovery payloads retained on the broker, persisted between restarts"""
+
+    def __init__(self, cache: FileCache, key: str) -> None:
+        self.cache = cache
+        self.key = key
+
+        state = cache.load(key) or {}
+        self.hashes: Dict[str, str] = state.get("hashes", {})
+        self.legacy_cleared: List[str] = state.get("legacy_cleared", [])
+
+    def save(self) -> None:
+        self.cache.save(
+            self.key, {"hashes": self.hashes, "legacy_cleared": self.legacy_cleared}
+        )
+
+
+def payload_hash(payload: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def build_discovery(
+    camera: CameraClient, topics: Topics, settings: Settings
+) -> Dict[str, Dict[str, Any]]:
+    """Build Home Assistant discovery config, keyed by entity"""
+
+    base_config = {
+        "availability_topic": topics.status,
+        # The QoS Home Assistant subscribes to state topics with
+        "qos": settings.publish_policies["state"].qos,
+        "device": {
+            "name": f"Amcrest {camera.device_type}",
+            "manufacturer": "Amcrest",
+            "model": camera.device_type,
+            "identifiers": camera.serial_number,
+            "sw_version": camera.amcrest_version,
+            "via_device": "amcrest2mqtt",
+        },
+    }
+
+    discovery = {}
+
+    if camera.is_doorbell:
+        discovery["doorbell"] = base_config | {
+            "state_topic": topics.doorbell,
+            "payload_on": "on",
+            "payload_off": "off",
+            "icon": "mdi:doorbell",
+            "name": camera.name,
+            "unique_id": f"{camera.serial_number}.doorbell",
+        }
+
+    if camera.is_ad410:
+        discovery["human"] = base_config | {
+            "state_topic": topics.human,
+            "payload_on": "on",
+            "payload_off": "off",
+            "device_class": "motion",
+            "name": f"{camera.name} Human",
+            "unique_id": f"{camera.serial_number}.human",
+        }
+
+    discovery["motion"] = base_config | {
+        "state_topic": topics.motion,
+        "payload_on": "on",
+        "payload_off": "off",
+        "device_class": "motion",
+        "name": f"{camera.name} Motion",
+        "unique_id": f"{camera.serial_number}.motion",
+    }
+
+    discovery["version"] = base_config | {
+        "state_topic": topics.config,
+        "value_template": "{{ value_json.sw_version }}",
+        "icon": "mdi:package-up",
+        "name": f"{camera.name} Version",
+        "unique_id": f"{camera.serial_number}.version",
+        "entity_category": "diagnostic",
+        "enabled_by_default": False,
+    }
+
+    discovery["serial_number"] = base_config | {
+        "state_topic": topics.config,
+        "value_template": "{{ value_json.serial_number }}",
+        "icon": "mdi:alphabetical-variant",
+        "name": f"{camera.name} Serial Number",
+        "unique_id": f"{camera.serial_number}.serial_number",
+        "entity_category": "diagnostic",
+        "enabled_by_default": False,
+    }
+
+    discovery["host"] = base_config | {
+        "state_topic": topics.config,
+        "value_template": "{{ value_json.host }}",
+        "icon": "mdi:ip-network",
+        "name": f"{camera.name} Host",
+        "unique_id": f"{camera.serial_number}.host",
+        "entity_category": "diagnostic",
+        "enabled_by_default": False,
+    }
+
+    if settings.snapshots:
+        discovery["snapshot"] = base_config | {
+            "topic": topics.snapshot,
+            "name": f"{camera.name} Snapshot",
+            "unique_id": f"{camera.serial_number}.snapshot",
+        }
+
+    if settings.poll_intervals.get("storage", 0) > 0:
+        discovery["storage_used_percent"] = base_config | {
+            "state_topic": topics.storage_used_percent,
+            "unit_of_measurement": "%",
+            "icon": "mdi:micro-sd",
+            "name": f"{camera.name} Storage Used %",
+            "object_id": f"{camera.device_slug}_storage_used_percent",
+            "unique_id": f"{camera.serial_number}.storage_used_percent",
+            "entity_category": "diagnostic",
+        }
+
+        discovery["storage_used"] = base_config | {
+            "state_topic": topics.storage_used,
+            "unit_of_measurement": "GB",
+            "icon": "mdi:micro-sd",
+            "name": f"{camera.name} Storage Used",
+            "unique_id": f"{camera.serial_number}.storage_used",
+            "entity_category": "diagnostic",
+        }
+
+        discovery["storage_total"] = base_config | {
+            "state_topic": topics.storage_total,
+            "unit_of_measurement": "GB",
+            "icon": "mdi:micro-sd",
+            "name": f"{camera.name} Storage Total",
+            "unique_id": f"{camera.serial_number}.storage_total",
+            "entity_category": "diagnostic",
+        }
+
+    if settings.poll_intervals.get("storage_health", 0) > 0:
+        discovery["storage_health"] = base_config | {
+            "state_topic": topics.storage_health,
+            "payload_on": "on",
+            "payload_off": "off",
+            "device_class": "problem",
+            "icon": "mdi:micro-sd",
+            "name": f"{camera.name} Storage Health",
+            "unique_id": f"{camera.serial_number}.storage_health",
+            "entity_category": "diagnostic",
+        }
+
+    return discovery
+
+
+def pending_discovery(
+    camera: CameraClient, topics: Topics, settings: Settings, store: DiscoveryStore
+) -> Dict[str, Tuple[Any, Optional[str]]]:
+    """Discovery config which changed since the last run
+
+    Returns topic -> (payload, hash to record once delivered), with an empty payload
+    for topics to clear.
+    """
+
+    discovery = build_discovery(camera, topics, settings)
+    messages: Dict[str, Tuple[Any, Optional[str]]] = {}
+
+    for entity, config in discovery.items():
+        digest = payload_hash(config)
+        topic = topics.home_assistant[entity]
+        if store.hashes.get(topic) != digest:
+            messages[topic] = (config, digest)
+
+        legacy_topic = topics.home_assistant_legacy.get(entity)
+        if legacy_topic and legacy_topic not in store.legacy_cleared:
+            messages[legacy_topic] = ("", None)
+
+    # Clear entities which are no longer discovered, e.g. storage sensors once disabled
+    current = {topics.home_assistant[entity] for entity in discovery}
+    for topic in store.hashes:
+        if topic not in current:
+            messages[topic] = ("", None)
+
+    return messages
+
+
+def discovery_messages(
+    pending: Dict[str, Tuple[Any, Optional[str]]],
+) -> List[MqttMessage]:
+    return [
+        MqttMessage(topic=topic, payload=payload, as_json=bool(payload))
+        for topic, (payload, _) in pending.items()
+    ]
+
+
+def record_discovery(
+    store: DiscoveryStore,
+    pending: Dict[str, Tuple[Any, Optional[str]]],
+    errors: List[Optional[Exception]],
+) -> None:
+    """Remember which discovery config was delivered, so it isn't published again"""
+
+    for (topic, (_, digest)), error in zip(pending.items(), errors):
+        if error is not None:
+            logger.warning(f"Error publishing discovery config to {topic}: {error}")
+        elif digest:
+            store.hashes[topic] = digest
+        elif topic in store.hashes:
+            del store.hashes[topic]
+        else:
+            store.legacy_cleared.append(topic)
+
+    store.save()
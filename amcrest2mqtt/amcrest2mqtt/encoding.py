@@ -0,0 +1,125 @@
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is optional
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover - cbor2 is optional
+    cbor2 = None
+
+
+logger = logging.getLogger(__name__)
+
+Serializer = Callable[[Any], bytes]
+
+
+def _stdlib_json(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def _orjson(payload: Any) -> bytes:
+    return orjson.dumps(payload)
+
+
+JSON_SERIALIZERS: Dict[str, Serializer] = {"json": _stdlib_json}
+if orjson is not None:
+    JSON_SERIALIZERS["orjson"] = _orjson
+
+
+def get_json_serializer(name: str = "auto") -> Serializer:
+    """Get a JSON serializer by name, "auto" picking the fastest one installed"""
+    if name == "auto":
+        name = "orjson" if "orjson" in JSON_SERIALIZERS else "json"
+
+    if name not in JSON_SERIALIZERS:
+        logger.warning(f"JSON serializer {name} is not available, using json")
+        name = "json"
+
+    logger.debug(f"Using {name} JSON serializer")
+    return JSON_SERIALIZERS[name]
+
+
+@dataclass(frozen=True)
+class Encoding:
+    name: str
+    serializer: Serializer
+    content_type: str
+
+
+def _msgpack(payload: Any) -> bytes:
+    return msgpack.packb(payload)
+
+
+def _cbor(payload: Any) -> bytes:
+    return cbor2.dumps(payload)
+
+
+# Binary encodings for the event firehose which are installed, by name
+BINARY_ENCODINGS: Dict[str, Encoding] = {}
+if msgpack is not None:
+    BINARY_ENCODINGS["msgpack"] = Encoding("msgpack", _msgpack, "application/msgpack")
+if cbor2 is not None:
+    BINARY_ENCODINGS["cbor"] = Encoding("cbor", _cbor, "application/cbor")
+
+
+def get_encoding(name: str = "json", json_serializer: str = "auto") -> Encoding:
+    """Get an encoding for the event firehose by name, falling back to JSON"""
+    if name in BINARY_ENCODINGS:
+        return BINARY_ENCODINGS[name]
+
+    if name != "json":
+        logger.warning(f"Event encoding {name} is not available, using json")
+    return Encoding("json", get_json_serializer(json_serializer), "application/json")
+
+
+Projection = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def _project(payload: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    projected = {}
+    for key, nested in fields.items():
+        if key not in payload:
+            continue
+        value = payload[key]
+        if nested is None:
+            projected[key] = value
+        elif isinstance(value, dict):
+            projected[key] = _project(value, nested)
+    return projected
+
+
+def get_projection(fields: Optional[List[str]]) -> Optional[Projection]:
+    """Build a function keeping only `fields` of an event payload
+
+    Nested fields are selected with dots, e.g. `data.Name`. Fields missing from a
+    payload are left out. Returns None when every field is kept.
+    """
+    if fields is None:
+        return None
+
+    # Field name -> None to keep the whole value, or the fields to keep within it
+    tree: Dict[str, Any] = {}
+    for field in fields:
+        node = tree
+        *parents, leaf = field.split(".")
+        for parent in parents:
+            child = node.setdefault(parent, {})
+            if child is None:
+                # The whole parent is kept already
+                break
+            node = child
+        else:
+            node[leaf] = None
+
+    return lambda payload: _project(payload, tree)
@@ -0,0 +1,257 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+
+# Seconds, from a fast local ack up to a camera call close to its timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """A metric family in the Prometheus text exposition format"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Metric):
+    """A gauge whose values are read from callbacks when scraped"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._functions: Dict[Labels, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], *labels: str) -> None:
+        with self._lock:
+            self._functions[labels] = function
+
+    def render(self) -> List[str]:
+        with self._lock:
+            functions = sorted(self._functions.items())
+        return super().render() + [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(function())}"
+            for labels, function in functions
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: count per bucket (the last one being +Inf), sum
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                labels, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, *labels: str) -> int:
+        counts, _ = self._values.get(labels, ([0], [0.0]))
+        return sum(counts)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total[0]))
+                for labels, (counts, total) in self._values.items()
+            )
+
+        lines = super().render()
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_format_labels(self.labels + ('le',), labels + (le,))} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}"
+            )
+            lines.append(
+                f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+            )
+        return lines
+
+
+class Metrics:
+    """Metrics collected by the bridge
+
+    Components take an optional Metrics and skip their hooks when it is None, so
+    running without metrics costs a single attribute check per hook.
+    """
+
+    def __init__(self) -> None:
+        self.events_received = Counter(
+            "amcrest2mqtt_events_received_total",
+            "Events received from cameras",
+            ["host", "code"],
+        )
+        self.publishes = Counter(
+            "amcrest2mqtt_mqtt_publishes_total",
+            "Messages published to MQTT",
+            ["topic"],
+        )
+        self.publish_errors = Counter(
+            "amcrest2mqtt_mqtt_publish_errors_total",
+            "Messages which could not be delivered to MQTT",
+            ["topic"],
+        )
+        self.publish_queue = Gauge(
+            "amcrest2mqtt_mqtt_publish_queue",
+            "Messages waiting to be acknowledged, or buffered while disconnected",
+            ["state"],
+        )
+        self.ack_latency = Histogram(
+            "amcrest2mqtt_mqtt_ack_latency_seconds",
+            "Time from publishing a message to paho reporting it as published",
+        )
+        self.camera_call_duration = Histogram(
+            "amcrest2mqtt_camera_call_duration_seconds",
+            "Duration of camera HTTP calls",
+            ["host", "call"],
+        )
+        self.camera_call_errors = Counter(
+            "amcrest2mqtt_camera_call_errors_total",
+            "Camera HTTP calls which failed or timed out",
+            ["host", "call"],
+        )
+        self.reconnects = Counter(
+            "amcrest2mqtt_reconnects_total",
+            "Reconnections to the MQTT server or a camera",
+            ["target"],
+        )
+        self.event_latency = Histogram(
+            "amcrest2mqtt_event_latency_seconds",
+            "Time spent on each stage of handling a camera event: route (waiting "
+            "for the broker to catch up on acks, then deriving sensor states), serialize, ack (broker round trip) and total (from "
+            "receiving the event to its ack)",
+            ["stage"],
+        )
+        self.startup = Histogram(
+            "amcrest2mqtt_startup_seconds",
+            "Time from starting a device to loading its details and to receiving "
+            "its first event",
+            ["stage"],
+        )
+        self.loop_lag = Histogram(
+            "amcrest2mqtt_event_loop_lag_seconds",
+            "How late the event loop ran a timer, a sign of blocking calls",
+        )
+
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in vars(self).values():
+            if isinstance(metric, Metric):
+                lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+    def serve(self, port: int, address: str = "") -> None:
+        """Serve metrics over HTTP from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                logger.debug(f"Metrics request: {format % args}")
+
+        self._server = ThreadingHTTPServer((address, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info(f"Serving metrics on port {self._server.server_address[1]}")
+
+    async def monitor_loop_lag(self, interval: float = 1) -> None:
+        """Measure how late the event loop wakes up from a sleep"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, time.monotonic() - started - interval))
@@ -1,11 +1,37 @@
-import json
+import asyncio
+import copy
 import logging
 import os
+import random
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple
 
-from paho.mqtt.client import MQTT_ERR_SUCCESS, Client, error_string
+from paho.mqtt.client import (
+    MQTT_ERR_NO_CONN,
+    MQTT_ERR_QUEUE_SIZE,
+    MQTT_ERR_SUCCESS,
+    MQTTMessage,
+    MQTTv5,
+    Client,
+    error_string,
+    topic_matches_sub,
+)
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.reasoncodes import ReasonCode
+
+from amcrest2mqtt.encoding import Serializer, get_json_serializer
+from amcrest2mqtt.metrics import Metrics
+from amcrest2mqtt.policy import PublishPolicies
+from amcrest2mqtt.spool import Spool
+from amcrest2mqtt.topics import OFFLINE
+from amcrest2mqtt.tracing import EventTrace
+from amcrest2mqtt.util import Backoff
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +46,164 @@ class MqttClientTLS:
     version: str
 
 
+@dataclass
+class MqttMessage:
+    topic: str
+    payload: Any
+    qos: Optional[int] = None
+    as_json: bool = False
+    content_type: Optional[str] = None
+    user_properties: Optional[List[Tuple[str, str]]] = None
+
+
+class MqttPublishError(Exception):
+    """Raised on a publish future when a message could not be delivered"""
+
+    def __init__(self, rc: int) -> None:
+        super().__init__(error_string(rc))
+        self.rc = rc
+
+
+class _PublishProperties(Properties):
+    """MQTT v5 PUBLISH properties which are packed once, however often they're sent"""
+
+    def __init__(self) -> None:
+        super().__init__(PacketTypes.PUBLISH)
+        object.__setattr__(self, "_packed", None)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, "_packed", None)
+        super().__setattr__(name, value)
+
+    def pack(self) -> bytes:
+        if self._packed is None:
+            object.__setattr__(self, "_packed", super().pack())
+        return self._packed
+
+
+def _reason(rc: Any) -> str:
+    # MQTT v5 callbacks are given a ReasonCode rather than an error number
+    return str(rc) if isinstance(rc, ReasonCode) else error_string(rc)
+
+
+def _resolve(
+    future: Future, mid: int = None, error: Optional[Exception] = None
+) -> None:
+    if future.done():
+        return
+    if error:
+        future.set_exception(error)
+    else:
+        future.set_result(mid)
+
+
+class _AsyncioTransport:
+    """Drives paho's network I/O from an asyncio event loop instead of a thread
+
+    The socket is watched with add_reader/add_writer, so reads, writes and acks all
+    happen on the loop which publishes. Keepalives and reconnects run in a task.
+
+    paho's reconnect() blocks on the TCP connect (up to its 5 second connect
+    timeout) and any TLS handshake, which would freeze every camera's event stream
+    while a broker is unreachable. It runs in a worker thread instead, as paho's own
+    network thread would, and the socket callbacks it makes are handed back to the
+    loop. Nothing else drives paho's network I/O until it returns.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        client: Client,
+        reconnect_min_delay: float,
+        reconnect_max_delay: float,
+    ) -> None:
+        self.loop = loop
+        self.client = client
+        self.backoff = Backoff(reconnect_min_delay, reconnect_max_delay)
+        self.task: Optional[asyncio.Task] = None
+        # Thread of the event loop, once running, to tell callbacks made by
+        # reconnect() in a worker thread
+        self._loop_thread: Optional[int] = None
+
+        self._set_callbacks(True)
+
+    def _set_callbacks(self, enabled: bool) -> None:
+        self.client.on_socket_open = self.on_socket_open if enabled else None
+        self.client.on_socket_close = self.on_socket_close if enabled else None
+        self.client.on_socket_register_write = (
+            self.on_socket_register_write if enabled else None
+        )
+        self.client.on_socket_unregister_write = (
+            self.on_socket_unregister_write if enabled else None
+        )
+
+    def start(self) -> None:
+        self.task = self.loop.create_task(self.run())
+
+    def run_blocking(self, done: Callable[[], bool], timeout: float) -> bool:
+        """Run the network loop without the event loop until done() or the timeout
+
+        Used when the event loop is blocked or closed, e.g. while exiting.
+        """
+        sock = self.client.socket()
+        if sock is not None and not self.loop.is_closed():
+            self.on_socket_close(self.client, None, sock)
+        self._set_callbacks(False)
+
+        deadline = time.monotonic() + timeout
+        try:
+            while not done() and time.monotonic() < deadline:
+                self.client.loop(timeout=0.1)
+        finally:
+            self._set_callbacks(True)
+            sock = self.client.socket()
+            if sock is not None and not self.loop.is_closed():
+                self.on_socket_open(self.client, None, sock)
+                if self.client.want_write():
+                    self.on_socket_register_write(self.client, None, sock)
+
+        return done()
+
+    def _on_loop(self, func: Callable[..., Any], *args: Any) -> None:
+        if self._loop_thread in (None, threading.get_ident()):
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def on_socket_open(self, client: Client, userdata: Any, sock: Any) -> None:
+        self._on_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client: Client, userdata: Any, sock: Any) -> None:
+        self._on_loop(self.loop.remove_reader, sock)
+        self._on_loop(self.loop.remove_writer, sock)
+
+    def on_socket_register_write(
+        self, client: Client, userdata: Any, sock: Any
+    ) -> None:
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(
+        self, client: Client, userdata: Any, sock: Any
+    ) -> None:
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def run(self) -> None:
+        self._loop_thread = threading.get_ident()
+        while True:
+            if self.client.loop_misc() == MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+                continue
+
+            # Disconnected, reconnect the way paho's own thread would
+            delay = self.backoff.next()
+            await asyncio.sleep(delay)
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                self.backoff.reset()
+            except OSError as error:
+                logger.warning(f"Could not reconnect to MQTT server: {error}")
+
+
 class MqttClient:
     def __init__(
         self,
@@ -28,13 +212,96 @@ class MqttClient:
         username: str = "",
         password: str = "",
         tls_config: MqttClientTLS = None,
+        serializer: Optional[Serializer] = None,
+        buffer_size: int = 1000,
+        reconnect_min_delay: float = 1,
+        reconnect_max_delay: float = 60,
+        spool: Optional[Spool] = None,
+        metrics: Optional[Metrics] = None,
+        transport: str = "thread",
+        max_inflight: int = 20,
+        policies: Optional[PublishPolicies] = None,
+        protocol: str = "3.1.1",
     ) -> None:
 
-        # Connect to MQTT
-        self.client = Client(
-            client_id=f"amcrest2mqtt_{str(os.urandom(8))}", clean_session=True
+        self.serializer = serializer or get_json_serializer()
+        # QoS and retain flag of each topic, unless publish() is given a QoS
+        self.policies = policies or PublishPolicies()
+
+        # Messages handed to paho but not yet acknowledged, keyed by message id
+        self._pending: Dict[int, Tuple[Future, int]] = {}
+        # Message ids acknowledged before publish() had a chance to track them
+        self._acked: Set[int] = set()
+        self._pending_lock = threading.Lock()
+
+        # Messages published while disconnected from the broker, sent on reconnect
+        self._buffer: Deque[Tuple[str, Any, int, Future, Optional[Properties]]] = (
+            deque()
         )
+        self._buffer_size = buffer_size
+        self._buffer_lock = threading.Lock()
+        self._connected = True
+
+        # Optional persistent store for messages published with spool=True while
+        # disconnected, which outlives the in-memory buffer and restarts. It is
+        # replayed from the event loop once connected, and messages published with
+        # spool=True keep going to it until the replay caught up, to stay in order.
+        self.spool = spool
+        self._loop = asyncio.get_event_loop() if spool is not None else None
+        self._replay: Optional[asyncio.Task] = None
+        self._replay_wanted = False
+
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.publish_queue.set_function(lambda: len(self._pending), "pending")
+            metrics.publish_queue.set_function(lambda: len(self._buffer), "buffered")
+
+        self._reconnect_min_delay = reconnect_min_delay
+        self._reconnect_max_delay = reconnect_max_delay
+
+        # Publishers awaiting drain() are held back while this many messages are
+        # waiting for their ack
+        self.max_inflight = max_inflight
+
+        # With MQTT v5, QoS 0 messages to topics whose policy allows it are sent
+        # with a topic alias once the topic has been sent in full on the connection.
+        # The broker says how many aliases it accepts when we connect.
+        self.protocol_v5 = protocol == "5"
+        self._alias_maximum = 0
+        self._aliases: Dict[str, int] = {}
+        self._alias_lock = threading.Lock()
+        # Most messages only carry the expiry and content type of their topic, so
+        # the properties are built once for each, and once more with the alias
+        self._topic_properties: Dict[Tuple[str, Optional[str]], Properties] = {}
+        self._aliased_properties: Dict[Tuple[str, Optional[str]], Properties] = {}
+
+        # Handler and QoS of each subscribed topic filter, subscribed again on every
+        # connection as the session is clean
+        self._subscriptions: Dict[str, Tuple[Callable[[MQTTMessage], None], int]] = {}
+        self._subscriptions_lock = threading.Lock()
+
+        # Connect to MQTT
+        client_id = f"amcrest2mqtt_{str(os.urandom(8))}"
+        if self.protocol_v5:
+            self.client = Client(client_id=client_id, protocol=MQTTv5)
+        else:
+            self.client = Client(client_id=client_id, clean_session=True)
+        self.client.on_connect = self.on_mqtt_connect
         self.client.on_disconnect = self.on_mqtt_disconnect
+        # paho's network thread reconnects by itself, doubling the delay each attempt
+        self.client.reconnect_delay_set(reconnect_min_delay, reconnect_max_delay)
+        self.client.on_publish = self.on_mqtt_publish
+        self.client.on_message = self.on_mqtt_message
+        self.client.max_inflight_messages_set(max_inflight)
+
+        self._transport: Optional[_AsyncioTransport] = None
+        if transport == "asyncio":
+            self._transport = _AsyncioTransport(
+                asyncio.get_event_loop(),
+                self.client,
+                reconnect_min_delay,
+                reconnect_max_delay,
+            )
         # self.client.will_set(
         #    topics["status"], payload="offline", qos=self.mqtt_qos, retain=True
         # )
@@ -52,7 +319,10 @@ class MqttClient:
 
         try:
             self.client.connect(host, port=port)
-            self.client.loop_start()
+            if self._transport is None:
+                self.client.loop_start()
+            else:
+                self._transport.start()
         except ConnectionError as error:
             logger.error(f"Could not connect to MQTT server: {error}")
             sys.exit(1)
@@ -61,38 +331,515 @@ class MqttClient:
         self,
         topic: str,
         payload: Any,
-        qos: int = 0,
+        qos: Optional[int] = None,
         exit_on_error: bool = True,
         as_json: bool = False,
+        callback: Optional[Callable[[Future], None]] = None,
+        spool: bool = False,
+        trace: Optional[EventTrace] = None,
+        content_type: Optional[str] = None,
+        user_properties: Optional[List[Tuple[str, str]]] = None,
+        serializer: Optional[Serializer] = None,
+        correlation_data: Optional[bytes] = None,
+    ) -> Future:
+        """Queue message for MQTT topic without waiting for delivery
+
+        Returns a future which resolves once paho reports the message as published,
+        or fails with MqttPublishError. `callback` is attached to that future.
+
+        The message is retained, and sent with the QoS unless given, as set by the
+        policy of its topic. With MQTT v5 the policy also sets its expiry, and
+        `content_type`, `user_properties` and `correlation_data` are sent along with
+        it.
+
+        `serializer` replaces the JSON serializer for this message, e.g. with a
+        binary encoding.
+
+        With `spool`, a message published while disconnected is written to the spool
+        (stamped with the time if it's a JSON object) and its future resolves to None.
+
+        With `trace` and metrics enabled, the serialization and ack times of the
+        message are recorded against the event which caused it.
+        """
+        future: Future = Future()
+        if callback:
+            future.add_done_callback(callback)
+
+        serializer = serializer or self.serializer
+        if qos is None:
+            qos = self.policies.for_topic(topic).qos
+
+        if (
+            spool
+            and self.spool is not None
+            and (not self._connected or self._replaying())
+        ):
+            if as_json and isinstance(payload, dict):
+                payload = payload | {"timestamp": time.time()}
+            self.spool.append(
+                topic,
+                serializer(payload) if as_json else payload,
+                qos,
+                content_type,
+                user_properties,
+            )
+            _resolve(future)
+            return future
+
+        serialize_started = time.monotonic()
+        payload = serializer(payload) if as_json else payload
+
+        if self.metrics is not None:
+            self._observe(topic, future)
+            if trace is not None:
+                self._observe_trace(trace, future, serialize_started)
+
+        properties = None
+        if self.protocol_v5:
+            properties = self._properties(
+                topic, content_type, user_properties, correlation_data
+            )
+
+        self._send(topic, payload, qos, future, exit_on_error, properties)
+        return future
+
+    def _properties(
+        self,
+        topic: str,
+        content_type: Optional[str],
+        user_properties: Optional[List[Tuple[str, str]]],
+        correlation_data: Optional[bytes] = None,
+    ) -> Properties:
+        shared = not user_properties and correlation_data is None
+        if shared and (topic, content_type) in self._topic_properties:
+            return self._topic_properties[topic, content_type]
+
+        properties = _PublishProperties()
+        expiry = self.policies.for_topic(topic).expiry
+        if expiry:
+            properties.MessageExpiryInterval = expiry
+        if content_type:
+            properties.ContentType = content_type
+        if user_properties:
+            properties.UserProperty = list(user_properties)
+        if correlation_data is not None:
+            properties.CorrelationData = correlation_data
+
+        if shared:
+            self._topic_properties[topic, content_type] = properties
+        return properties
+
+    def _send(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int,
+        future: Future,
+        exit_on_error: bool = False,
+        properties: Optional[Properties] = None,
+        flushing: bool = False,
     ) -> None:
-        """Publish message to MQTT topic"""
-        payload = json.dumps(payload) if as_json else payload
-        msg = self.client.publish(
-            topic,
-            payload=payload,
-            qos=qos,
-            retain=True,
-        )
+        # Buffered messages are sent while _connected is still False, so newer
+        # messages queue up behind them
+        if not flushing:
+            with self._buffer_lock:
+                if not self._connected:
+                    self._buffer_message(topic, payload, qos, future, properties)
+                    return
+
+        policy = self.policies.for_topic(topic)
+        if properties is not None and qos == 0 and policy.alias:
+            msg = self._publish_aliased(topic, payload, policy.retain, properties)
+        else:
+            msg = self.client.publish(
+                topic,
+                payload=payload,
+                qos=qos,
+                retain=policy.retain,
+                properties=properties,
+            )
 
-        if msg.rc == MQTT_ERR_SUCCESS:
-            msg.wait_for_publish(2)
+        # paho keeps QoS > 0 messages itself and resends them once reconnected
+        if msg.rc == MQTT_ERR_SUCCESS or (msg.rc == MQTT_ERR_NO_CONN and qos > 0):
+            self._track(msg.mid, future, qos)
             return
 
+        # paho noticed the connection dropped before on_disconnect was called
+        if msg.rc == MQTT_ERR_NO_CONN:
+            with self._buffer_lock:
+                if not self.client.is_connected():
+                    self._connected = False
+                    self._buffer_message(topic, payload, qos, future, properties)
+                    return
+
         logger.error(f"Error publishing MQTT message: {error_string(msg.rc)}")
+        _resolve(future, error=MqttPublishError(msg.rc))
 
         if exit_on_error:
             logger.error("MqttClient exiting, exit_on_error=True")
             os._exit(msg.rc)
 
-    def on_mqtt_disconnect(self, client: Client, userdata: str, rc: int) -> None:
+    def _publish_aliased(
+        self, topic: str, payload: Any, retain: bool, properties: Properties
+    ) -> Any:
+        # Only QoS 0 messages are aliased, as paho would resend QoS > 0 messages
+        # with the alias after reconnecting, when the broker no longer knows it
+        with self._alias_lock:
+            alias = self._aliases.get(topic)
+            if alias is None and len(self._aliases) < self._alias_maximum:
+                # The first message carries the full topic, which sets the alias
+                alias = self._aliases[topic] = len(self._aliases) + 1
+                publish_topic = topic
+            elif alias is not None:
+                publish_topic = ""
+            else:
+                publish_topic = topic
+
+            key = (topic, getattr(properties, "ContentType", None))
+            if alias is not None and properties is self._topic_properties.get(key):
+                if key not in self._aliased_properties:
+                    aliased = copy.copy(properties)
+                    aliased.TopicAlias = alias
+                    self._aliased_properties[key] = aliased
+                properties = self._aliased_properties[key]
+            elif alias is not None:
+                # Copied, so a buffered message doesn't keep an alias of this
+                # connection
+                properties = copy.copy(properties)
+                properties.TopicAlias = alias
+
+            # Published under the lock, so no message using the alias is queued
+            # before the one which sets it
+            return self.client.publish(
+                publish_topic,
+                payload=payload,
+                qos=0,
+                retain=retain,
+                properties=properties,
+            )
+
+    def _observe(self, topic: str, future: Future) -> None:
+        self.metrics.publishes.inc(topic)
+        started = time.monotonic()
+
+        def done(future: Future) -> None:
+            if future.exception():
+                self.metrics.publish_errors.inc(topic)
+            else:
+                self.metrics.ack_latency.observe(time.monotonic() - started)
+
+        future.add_done_callback(done)
+
+    def _observe_trace(
+        self, trace: EventTrace, future: Future, serialize_started: float
+    ) -> None:
+        published = time.monotonic()
+        self.metrics.event_latency.observe(published - serialize_started, "serialize")
+
+        def done(future: Future) -> None:
+            if not future.exception():
+                self.metrics.event_latency.observe(time.monotonic() - published, "ack")
+                self.metrics.event_latency.observe(trace.since_received(), "total")
+
+        future.add_done_callback(done)
+
+    def _buffer_message(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int,
+        future: Future,
+        properties: Optional[Properties] = None,
+    ) -> None:
+        # Called with _buffer_lock held
+        if len(self._buffer) >= self._buffer_size:
+            dropped = self._buffer.popleft()[3]
+            _resolve(dropped, error=MqttPublishError(MQTT_ERR_QUEUE_SIZE))
+
+        self._buffer.append((topic, payload, qos, future, properties))
+
+    def _flush_buffer(self) -> None:
+        # Messages published while flushing are buffered too, and sent in order
+        # until the buffer is empty and the client is marked connected
+        sent = 0
+        while self.client.is_connected():
+            with self._buffer_lock:
+                if not self._buffer:
+                    self._connected = True
+                    break
+                buffered = list(self._buffer)
+                self._buffer.clear()
+
+            for topic, payload, qos, future, properties in buffered:
+                self._send(
+                    topic, payload, qos, future, properties=properties, flushing=True
+                )
+            sent += len(buffered)
+
+        if sent:
+            logger.info(f"Sent {sent} messages buffered while disconnected")
+
+        if self.spool is not None and self._connected:
+            self._loop.call_soon_threadsafe(self._start_replay)
+
+    def _replaying(self) -> bool:
+        return self._replay is not None and not self._replay.done()
+
+    def _start_replay(self) -> None:
+        # A replay still waiting on the previous connection picks this one up
+        self._replay_wanted = True
+        if not self._replaying():
+            self._replay = asyncio.ensure_future(self._replay_spool())
+
+    async def _replay_spool(self) -> None:
+        while self._replay_wanted:
+            self._replay_wanted = False
+            try:
+                await self._replay_spool_once()
+            except Exception:
+                logger.exception("Error replaying spooled messages")
+
+    async def _replay_spool_once(self) -> None:
+        """Send spooled messages in order, paced by drain()
+
+        Messages are removed from the spool once delivered, those which fail stay
+        for the next connection.
+        """
+        loop = asyncio.get_running_loop()
+        replayed = 0
+        while self._connected:
+            rows = await loop.run_in_executor(None, self.spool.peek)
+            if not rows:
+                break
+
+            futures = []
+            for row in rows:
+                properties = None
+                if self.protocol_v5:
+                    properties = self._properties(
+                        row.topic, row.content_type, row.user_properties
+                    )
+                future: Future = Future()
+                self._send(
+                    row.topic, row.payload, row.qos, future, properties=properties
+                )
+                futures.append(asyncio.wrap_future(future))
+                await self.drain()
+
+            await asyncio.wait(futures)
+            delivered = [
+                row.id for row, future in zip(rows, futures) if not future.exception()
+            ]
+            await loop.run_in_executor(None, self.spool.remove, delivered)
+            replayed += len(delivered)
+            if len(delivered) < len(rows):
+                logger.warning(
+                    f"{len(rows) - len(delivered)} spooled messages were not "
+                    "delivered, keeping them for the next connection"
+                )
+                break
+
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled messages")
+
+    async def publish_many(
+        self,
+        messages: Sequence[MqttMessage],
+        timeout: float = 10,
+        exit_on_error: bool = False,
+    ) -> List[Optional[Exception]]:
+        """Publish a batch of messages at once and wait for all of them to be delivered
+
+        Every message is handed to paho before waiting, so the batch costs about one
+        round trip to the broker rather than one per message. Returns the error of
+        each message, or None if it was delivered, in the order of `messages`.
+        Messages not delivered within `timeout` seconds fail with TimeoutError.
+
+        Unlike publish, a message which can't be sent doesn't end the process unless
+        `exit_on_error` is set, as callers act on the errors returned.
+        """
+        futures = [
+            asyncio.wrap_future(
+                self.publish(
+                    topic=message.topic,
+                    payload=message.payload,
+                    qos=message.qos,
+                    as_json=message.as_json,
+                    exit_on_error=exit_on_error,
+                    content_type=message.content_type,
+                    user_properties=message.user_properties,
+                )
+            )
+            for message in messages
+        ]
+        if futures:
+            await asyncio.wait(futures, timeout=timeout)
+
+        errors: List[Optional[Exception]] = []
+        for future in futures:
+            if not future.done():
+                # Retrieve the outcome once it arrives, so it isn't logged as lost
+                future.add_done_callback(lambda future: future.exception())
+                errors.append(TimeoutError(f"Not delivered within {timeout} seconds"))
+            else:
+                errors.append(future.exception())
+        return errors
+
+    async def async_publish(self, topic: str, payload: Any, **kwargs: Any) -> None:
+        """Publish message to MQTT topic and wait for it to be delivered"""
+        await asyncio.wrap_future(self.publish(topic, payload, **kwargs))
+
+    async def drain(self) -> None:
+        """Wait until fewer than max_inflight messages are waiting for their ack
+
+        Returns straight away while disconnected, as messages are then buffered.
+        """
+        while self._connected and len(self._pending) >= self.max_inflight:
+            with self._pending_lock:
+                if not self._pending:
+                    return
+                oldest = next(iter(self._pending.values()))[0]
+
+            await asyncio.wait([asyncio.wrap_future(oldest)])
+
+    def flush(self, timeout: float = 2) -> bool:
+        """Wait for all pending messages to be delivered, returns False on timeout"""
+        if self._transport is not None:
+            # Acks arrive on the event loop, which is blocked by this call
+            return self._transport.run_blocking(lambda: not self._pending, timeout)
+
+        with self._pending_lock:
+            pending = [future for future, _ in self._pending.values()]
+
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
+
+    def _track(self, mid: int, future: Future, qos: int) -> None:
+        with self._pending_lock:
+            acked = mid in self._acked
+            if acked:
+                self._acked.discard(mid)
+            else:
+                self._pending[mid] = (future, qos)
+
+        if acked:
+            _resolve(future, mid)
+
+    def on_mqtt_publish(self, client: Client, userdata: str, mid: int) -> None:
+        with self._pending_lock:
+            pending = self._pending.pop(mid, None)
+            if pending is None:
+                self._acked.add(mid)
+                return
+
+        _resolve(pending[0], mid)
+
+    def subscribe(
+        self, topic: str, handler: Callable[[MQTTMessage], None], qos: int = 0
+    ) -> None:
+        """Call `handler` with every message on `topic`, which may hold wildcards
+
+        Handlers are called from paho's network thread, or the event loop with the
+        asyncio transport, so they must hand messages over rather than block.
+        """
+        with self._subscriptions_lock:
+            self._subscriptions[topic] = (handler, qos)
+        # Subscribed on connect when not connected yet
+        self.client.subscribe(topic, qos)
+
+    def unsubscribe(self, topic: str) -> None:
+        with self._subscriptions_lock:
+            self._subscriptions.pop(topic, None)
+        self.client.unsubscribe(topic)
+
+    def on_mqtt_message(
+        self, client: Client, userdata: str, message: MQTTMessage
+    ) -> None:
+        with self._subscriptions_lock:
+            handlers = [
+                handler
+                for topic, (handler, _) in self._subscriptions.items()
+                if topic_matches_sub(topic, message.topic)
+            ]
+
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception:
+                logger.exception(f"Error handling MQTT message on {message.topic}")
+
+    def on_mqtt_connect(
+        self,
+        client: Client,
+        userdata: str,
+        flags: Dict[str, Any],
+        rc: int,
+        properties: Optional[Properties] = None,
+    ) -> None:
         if rc != 0:
-            logger.error("Unexpected MQTT disconnection")
-            self.client.disconnect()
+            logger.error(f"MQTT connection refused: {_reason(rc)}")
+            return
+
+        # Aliases only last as long as the connection
+        with self._alias_lock:
+            self._aliases.clear()
+            self._aliased_properties.clear()
+            self._alias_maximum = getattr(properties, "TopicAliasMaximum", 0)
+
+        with self._buffer_lock:
+            reconnected = not self._connected
+
+        if reconnected:
+            logger.info("Reconnected to MQTT server")
+            if self.metrics is not None:
+                self.metrics.reconnects.inc("mqtt")
+
+        with self._subscriptions_lock:
+            subscriptions = [
+                (topic, qos) for topic, (_, qos) in self._subscriptions.items()
+            ]
+        if subscriptions:
+            self.client.subscribe(subscriptions)
+
+        # Also runs on the first connection, to replay anything spooled before a restart
+        self._flush_buffer()
 
-    def exit_gracefully(self, topic: str, rc: int, skip_mqtt: bool = False) -> None:
+    def on_mqtt_disconnect(
+        self,
+        client: Client,
+        userdata: str,
+        rc: int,
+        properties: Optional[Properties] = None,
+    ) -> None:
+        with self._buffer_lock:
+            self._connected = False
+
+        if rc != 0:
+            # Jitter the first delay so a fleet of bridges doesn't reconnect at once
+            delay = self._reconnect_min_delay * random.uniform(0.5, 1.5)
+            logger.error(
+                f"Unexpected MQTT disconnection, reconnecting in {delay:.1f} seconds"
+            )
+            self.client.reconnect_delay_set(delay, self._reconnect_max_delay)
+
+        # QoS 0 messages which were not written to the socket are lost
+        with self._pending_lock:
+            lost = [mid for mid, (_, qos) in self._pending.items() if qos == 0]
+            futures = [self._pending.pop(mid)[0] for mid in lost]
+            self._acked.clear()
+
+        for future in futures:
+            _resolve(future, error=MqttPublishError(MQTT_ERR_NO_CONN))
+
+    def exit_gracefully(
+        self, topics: List[str], rc: int, skip_mqtt: bool = False
+    ) -> None:
+        """Mark the given status topics offline and exit"""
         logger.info("MqttClient exiting")
         if self.client.is_connected() and not skip_mqtt:
-            self.publish(topic=topic, payload="offline", exit_on_error=False)
+            for topic in topics:
+                self.publish(topic=topic, payload=OFFLINE, exit_on_error=False)
+            self.flush(timeout=2)
             self.client.disconnect()
 
         # Use os._exit instead of sys.exit to ensure an MQTT disconnect event causes the program to exit correctly as they
@@ -0,0 +1,87 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+
+TOPIC_CLASSES = ("discovery", "state", "firehose", "diagnostics")
+
+# Class of the topics under amcrest2mqtt/{serial}/, by their first level. Anything
+# else is a sensor state. Command responses are only of interest as they happen.
+_SUBTOPIC_CLASSES = {
+    "event": "firehose",
+    "response": "firehose",
+    "config": "diagnostics",
+    "status": "diagnostics",
+    "storage": "diagnostics",
+}
+
+
+@dataclass(frozen=True)
+class PublishPolicy:
+    qos: int = 0
+    retain: bool = True
+    # MQTT v5 only: seconds the broker keeps an undelivered message, and whether
+    # QoS 0 messages may be sent with a topic alias instead of the full topic
+    expiry: Optional[int] = None
+    alias: bool = False
+
+
+def default_policies(qos: int = 0) -> Dict[str, PublishPolicy]:
+    """Retain everything but the event firehose, which would churn the retained store
+
+    Events are only worth delivering for a few minutes, and are sent often enough
+    to be worth a topic alias along with sensor states.
+    """
+    return {
+        "discovery": PublishPolicy(qos=qos),
+        "state": PublishPolicy(qos=qos, alias=True),
+        "firehose": PublishPolicy(qos=0, retain=False, expiry=300, alias=True),
+        "diagnostics": PublishPolicy(qos=qos),
+    }
+
+
+def policies_from_env(qos: int = 0) -> Dict[str, PublishPolicy]:
+    """Defaults, overridden by MQTT_{CLASS}_QOS, _RETAIN and _EXPIRY
+
+    An expiry of 0 means messages never expire.
+    """
+    policies = default_policies(qos)
+    for topic_class, policy in policies.items():
+        prefix = f"MQTT_{topic_class.upper()}"
+        retain = os.getenv(f"{prefix}_RETAIN")
+        expiry = int(os.getenv(f"{prefix}_EXPIRY", policy.expiry or 0))
+        policies[topic_class] = replace(
+            policy,
+            qos=int(os.getenv(f"{prefix}_QOS", policy.qos)),
+            retain=policy.retain if retain is None else retain == "true",
+            expiry=expiry or None,
+        )
+    return policies
+
+
+class PublishPolicies:
+    """Chooses how a message is published from the class of its topic"""
+
+    def __init__(
+        self,
+        policies: Optional[Dict[str, PublishPolicy]] = None,
+        home_assistant_prefix: str = "homeassistant",
+    ) -> None:
+        self.policies = default_policies() | (policies or {})
+        self.home_assistant_prefix = home_assistant_prefix
+        self._cache: Dict[str, PublishPolicy] = {}
+
+    def classify(self, topic: str) -> str:
+        if topic.startswith(f"{self.home_assistant_prefix}/"):
+            return "discovery"
+
+        levels = topic.split("/")
+        if len(levels) > 2 and levels[0] == "amcrest2mqtt":
+            return _SUBTOPIC_CLASSES.get(levels[2], "state")
+        return "state"
+
+    def for_topic(self, topic: str) -> PublishPolicy:
+        policy = self._cache.get(topic)
+        if policy is None:
+            policy = self._cache[topic] = self.policies[self.classify(topic)]
+        return policy
@@ -0,0 +1,164 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict
+from typing import IO, Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from amcrest2mqtt.camera import CameraClient, CameraDetails
+
+
+logger = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class EventRecorder:
+    """Writes the events of a camera to a JSON lines file, gzipped if it ends in .gz
+
+    The first line holds the camera details, so a replay doesn't need the camera.
+    Every following line is `[seconds since the recording started, code, payload]`.
+
+    Events are only queued in memory; a background thread writes and flushes them
+    in batches every `flush_interval` seconds, so the disk never holds up events
+    and a crash loses at most that many seconds of them.
+    """
+
+    def __init__(
+        self, path: str, camera: CameraClient, flush_interval: float = 1
+    ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self._started = time.monotonic()
+        self._pending: List[Any] = [
+            {
+                "version": RECORDING_VERSION,
+                "host": camera.host,
+                "started": time.time(),
+                "details": asdict(camera.details),
+            }
+        ]
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._writer, name="recorder", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"Recording events from {camera.host} to {path}")
+
+    @classmethod
+    def for_camera(cls, directory: str, camera: CameraClient) -> "EventRecorder":
+        name = f"{camera.serial_number}-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+        return cls(os.path.join(directory, name), camera)
+
+    def write(self, code: str, payload: Dict[str, Any]) -> None:
+        entry = [round(time.monotonic() - self._started, 3), code, payload]
+        with self._condition:
+            self._pending.append(entry)
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Stop recording once queued events are written, without waiting for it"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def wait_closed(self, timeout: Optional[float] = None) -> None:
+        self._thread.join(timeout)
+
+    def _writer(self) -> None:
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            with _open(self.path, "w") as file:
+                closed = False
+                while not closed:
+                    with self._condition:
+                        self._condition.wait_for(lambda: self._pending or self._closed)
+                        # Give a burst of events a moment to arrive so they share a
+                        # write, unless recording stopped
+                        self._condition.wait_for(
+                            lambda: self._closed, timeout=self.flush_interval
+                        )
+                        batch, self._pending = self._pending, []
+                        closed = self._closed
+
+                    file.write(
+                        "".join(
+                            json.dumps(entry, separators=(",", ":")) + "\n"
+                            for entry in batch
+                        )
+                    )
+                    file.flush()
+        except (OSError, TypeError, ValueError) as error:
+            logger.error(f"Could not record events to {self.path}: {error}")
+
+
+async def record_events(
+    events: AsyncIterator[Event], recorder: EventRecorder
+) -> AsyncIterator[Event]:
+    """Pass events through, recording each of them"""
+    try:
+        async for code, payload in events:
+            recorder.write(code, payload)
+            yield code, payload
+    finally:
+        recorder.close()
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    with _open(path, "r") as file:
+        header = json.loads(file.readline())
+
+    if header.get("version") != RECORDING_VERSION:
+        raise ValueError(f"Unsupported recording version in {path}")
+
+    header["details"] = CameraDetails(**header["details"])
+    return header
+
+
+def _lines(file: IO[str], path: str) -> Iterator[str]:
+    try:
+        yield from file
+    except EOFError:
+        # Recordings cut short by a crash are missing the gzip trailer
+        logger.warning(f"Recording {path} ends abruptly, replaying what was saved")
+
+
+async def replay_events(path: str, speed: float = 1) -> AsyncIterator[Event]:
+    """Yield the events of a recording, keeping their timing scaled by `speed`
+
+    A speed of 2 replays twice as fast, 0 replays as fast as possible.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    with _open(path, "r") as file:
+        file.readline()
+        for line in _lines(file, path):
+            offset, code, payload = json.loads(line)
+
+            if speed > 0:
+                # Sleep towards the scheduled time rather than by the gap between
+                # events, so a slow consumer catches up instead of drifting
+                delay = started + offset / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                # Still yield to the event loop so publishes and timers can run
+                await asyncio.sleep(0)
+
+            yield code, payload
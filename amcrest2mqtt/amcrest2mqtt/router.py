@@ -0,0 +1,97 @@
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.topics import OFF, ON, Topics
+
+
+logger = logging.getLogger(__name__)
+
+# Turns an event payload into the state to publish, or None to publish nothing
+EventHandler = Callable[[Dict[str, Any]], Optional[bytes]]
+
+
+@dataclass(frozen=True)
+class EventHandlerSpec:
+    code: str
+    topic: str
+    handler: EventHandler
+    supported: Callable[[CameraClient], bool]
+
+
+HANDLERS: List[EventHandlerSpec] = []
+
+
+def event_handler(
+    code: str,
+    topic: str,
+    supported: Callable[[CameraClient], bool] = lambda camera: True,
+) -> Callable[[EventHandler], EventHandler]:
+    """Register a handler publishing events with `code` to the `topic` topic
+
+    `supported` decides per camera whether the handler applies, so that e.g. AD110
+    doorbells can map a different event code to the same topic.
+    """
+
+    def decorator(handler: EventHandler) -> EventHandler:
+        HANDLERS.append(EventHandlerSpec(code, topic, handler, supported))
+        return handler
+
+    return decorator
+
+
+class EventRouter:
+    """Maps event codes to their handlers and topics, built once per camera"""
+
+    def __init__(self, routes: Dict[str, List[Tuple[str, EventHandler]]]) -> None:
+        self.routes = routes
+
+    @classmethod
+    def for_camera(
+        cls,
+        camera: CameraClient,
+        topics: Topics,
+        handlers: Optional[List[EventHandlerSpec]] = None,
+    ) -> "EventRouter":
+        routes: Dict[str, List[Tuple[str, EventHandler]]] = {}
+        for spec in HANDLERS if handlers is None else handlers:
+            if spec.supported(camera):
+                routes.setdefault(spec.code, []).append(
+                    (topics[spec.topic], spec.handler)
+                )
+
+        logger.debug(f"Routing event codes: {', '.join(routes)}")
+        return cls(routes)
+
+    @property
+    def codes(self) -> List[str]:
+        """Event codes with at least one handler"""
+        return list(self.routes)
+
+    def route(self, code: str, payload: Dict[str, Any]) -> Iterator[Tuple[str, bytes]]:
+        """Yield (topic, state) pairs to publish for an event"""
+        for topic, handler in self.routes.get(code, ()):
+            state = handler(payload)
+            if state is not None:
+                yield topic, state
+
+
+@event_handler("VideoMotion", "motion", supported=lambda camera: not camera.is_ad110)
+@event_handler(
+    "ProfileAlarmTransmit", "motion", supported=lambda camera: camera.is_ad110
+)
+def motion(payload: Dict[str, Any]) -> Optional[bytes]:
+    return ON if payload["action"] == "Start" else OFF
+
+
+@event_handler("CrossRegionDetection", "human")
+def human(payload: Dict[str, Any]) -> Optional[bytes]:
+    if payload["data"].get("ObjectType") != "Human":
+        return None
+    return ON if payload["action"] == "Start" else OFF
+
+
+@event_handler("_DoTalkAction_", "doorbell")
+def doorbell(payload: Dict[str, Any]) -> Optional[bytes]:
+    return ON if payload["data"]["Action"] == "Invite" else OFF
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import random
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from amcrest import AmcrestError
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.mqtt import MqttMessage
+from amcrest2mqtt.state import StateTracker
+from amcrest2mqtt.topics import OFF, ON, Topics
+from amcrest2mqtt.util import to_gb
+
+
+logger = logging.getLogger(__name__)
+
+# Reads a sensor from the camera, returning values keyed by entity. Readers block,
+# so they are always run on the camera's executor.
+SensorReader = Callable[[CameraClient], Dict[str, Any]]
+
+_STORAGE_STATE = re.compile(r"\.State=(\w+)")
+_STORAGE_ERROR = re.compile(r"\.IsError=(\w+)")
+
+
+@dataclass(frozen=True)
+class PeriodicSensorSpec:
+    name: str
+    read: SensorReader
+    entities: Tuple[str, ...]
+
+
+SENSORS: List[PeriodicSensorSpec] = []
+
+
+def periodic_sensor(
+    name: str, entities: Tuple[str, ...]
+) -> Callable[[SensorReader], SensorReader]:
+    """Register a reader polled every `{NAME}_POLL_INTERVAL` seconds
+
+    The reader returns a value for each of its entities, which are published to the
+    topics of the same name.
+    """
+
+    def decorator(read: SensorReader) -> SensorReader:
+        SENSORS.append(PeriodicSensorSpec(name, read, entities))
+        return read
+
+    return decorator
+
+
+class SensorScheduler:
+    """Polls the periodic sensors of a camera, publishing values which changed
+
+    Each sensor runs on its own interval, with the first read delayed by up to
+    `jitter` seconds so a fleet of cameras isn't polled all at once. The values of a
+    sensor which changed are published together with `publish_many`.
+    """
+
+    def __init__(
+        self,
+        camera: CameraClient,
+        topics: Topics,
+        publish_many: Callable[
+            [Sequence[MqttMessage]], Awaitable[List[Optional[Exception]]]
+        ],
+        intervals: Dict[str, float],
+        jitter: float = 0,
+        sensors: Optional[List[PeriodicSensorSpec]] = None,
+    ) -> None:
+        self.camera = camera
+        self.topics = topics
+        self.intervals = intervals
+        self.jitter = jitter
+        self.sensors = [
+            spec
+            for spec in (SENSORS if sensors is None else sensors)
+            if intervals.get(spec.name, 0) > 0
+        ]
+        self.publish_many = publish_many
+        # Values which changed in the current poll, collected by the tracker
+        self._changed: List[MqttMessage] = []
+        self.tracker = StateTracker(
+            publish=lambda topic, value: self._changed.append(
+                MqttMessage(topic=topic, payload=value)
+            )
+        )
+
+    async def run(self) -> None:
+        tasks = [asyncio.ensure_future(self._poll(spec)) for spec in self.sensors]
+        try:
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _poll(self, spec: PeriodicSensorSpec) -> None:
+        interval = self.intervals[spec.name]
+        await asyncio.sleep(random.uniform(0, min(self.jitter, interval)))
+
+        while True:
+            await self.poll(spec)
+            await asyncio.sleep(interval)
+
+    async def poll(self, spec: PeriodicSensorSpec) -> None:
+        logger.debug(f"Fetching {spec.name} sensors from {self.camera.host}...")
+        try:
+            values = await self.camera.run(spec.read, self.camera, name=spec.name)
+        except AmcrestError as error:
+            logger.warning(f"Error fetching {spec.name} sensors {error}")
+            return
+        except Exception:
+            logger.exception(f"Unexpected error fetching {spec.name} sensors")
+            return
+
+        for entity, value in values.items():
+            self.tracker.update(self.topics[entity], value)
+
+        messages, self._changed = self._changed, []
+        if not messages:
+            return
+
+        errors = await self.publish_many(messages)
+        for message, error in zip(messages, errors):
+            if error is not None:
+                logger.warning(f"Error publishing {spec.name} sensor: {error}")
+                # Forget the value so the next poll publishes it again
+                self.tracker.states.pop(message.topic, None)
+
+
+@periodic_sensor("storage", ("storage_used_percent", "storage_used", "storage_total"))
+def read_storage(camera: CameraClient) -> Dict[str, Any]:
+    storage = camera.client.storage_all
+    return {
+        "storage_used_percent": str(storage["used_percent"]),
+        "storage_used": to_gb(float(storage["used"][0])),
+        "storage_total": to_gb(float(storage["total"][0])),
+    }
+
+
+@periodic_sensor("storage_health", ("storage_health",))
+def read_storage_health(camera: CameraClient) -> Dict[str, Any]:
+    info = camera.client.storage_device_info
+    states = _STORAGE_STATE.findall(info)
+    errors = _STORAGE_ERROR.findall(info)
+
+    # No storage reported at all means the card is missing or unreadable
+    healthy = bool(states) and all(state == "Success" for state in states)
+    healthy = healthy and not any(error == "true" for error in errors)
+    return {"storage_health": OFF if healthy else ON}
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from amcrest import AmcrestError
+
+from amcrest2mqtt.camera import CameraClient
+
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotFetcher:
+    """Fetches snapshots from a camera when triggered by an event
+
+    A trigger while a fetch is in flight is merged into it rather than starting
+    another. `limit` bounds concurrent fetches across cameras.
+
+    The latest image is kept in memory, and served instead of fetching another while
+    it is less than `max_age` seconds old.
+    """
+
+    def __init__(
+        self,
+        camera: CameraClient,
+        publish: Callable[[bytes], Any],
+        limit: Optional[asyncio.Semaphore] = None,
+        max_age: float = 0,
+    ) -> None:
+        self.camera = camera
+        self.publish = publish
+        self.limit = limit or asyncio.Semaphore(1)
+        self.max_age = max_age
+        self.latest: Optional[bytes] = None
+        # time.monotonic() when the latest image was fetched
+        self.latest_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def fresh(self) -> Optional[bytes]:
+        """The latest image if it is less than max_age seconds old"""
+        if self.latest_at is None or time.monotonic() - self.latest_at >= self.max_age:
+            return None
+        return self.latest
+
+    async def get(self) -> Optional[bytes]:
+        """Publish the fresh latest image, or fetch one, returning None on failure"""
+        image = self.fresh
+        if image is not None:
+            logger.debug(f"Using cached snapshot from {self.camera.host}")
+            self.publish(image)
+            return image
+
+        # Shielded, as the fetch may be shared with events or other callers
+        fetch = self.trigger()
+        try:
+            return await asyncio.shield(fetch)
+        except asyncio.CancelledError:
+            if not fetch.cancelled():
+                raise
+            return None
+
+    def republish(self) -> None:
+        """Publish the latest image again if it is fresh, e.g. for new subscribers"""
+        image = self.fresh
+        if image is not None:
+            self.publish(image)
+
+    def trigger(self) -> asyncio.Task:
+        """Start fetching a snapshot, or return the fetch already in flight"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._fetch())
+        return self._task
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _fetch(self) -> Optional[bytes]:
+        async with self.limit:
+            try:
+                image = await self.camera.run(
+                    lambda: self.camera.client.snapshot(stream=False), name="snapshot"
+                )
+            except AmcrestError as error:
+                logger.warning(
+                    f"Error fetching snapshot from {self.camera.host}: {error}"
+                )
+                return None
+
+        self.latest = image
+        self.latest_at = time.monotonic()
+        self.publish(image)
+        return image
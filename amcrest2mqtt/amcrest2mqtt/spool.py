@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Columns added since the spool was first released, added to older spools on open
+_ADDED_COLUMNS = {"content_type": "TEXT", "user_properties": "TEXT"}
+
+
+@dataclass
+class SpooledMessage:
+    id: int
+    topic: str
+    payload: Any
+    qos: int
+    # MQTT v5 properties to send the message with when replayed
+    content_type: Optional[str] = None
+    user_properties: Optional[List[Tuple[str, str]]] = None
+
+
+class Spool:
+    """Persistent FIFO of messages which could not be delivered to the broker
+
+    Messages are kept in SQLite (WAL mode), capped by total payload size and age.
+    Appends only enqueue in memory; a background thread writes them in batches so
+    the event loop never waits on the disk.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 50 * 1024 * 1024,
+        max_age: float = 24 * 60 * 60,
+        batch_interval: float = 0.5,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_interval = batch_interval
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "created REAL NOT NULL, "
+            "topic TEXT NOT NULL, "
+            "payload BLOB, "
+            "qos INTEGER NOT NULL, "
+            "content_type TEXT, "
+            "user_properties TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(messages)")}
+        for column, column_type in _ADDED_COLUMNS.items():
+            if column not in columns:
+                self._db.execute(
+                    f"ALTER TABLE messages ADD COLUMN {column} {column_type}"
+                )
+
+        # Total payload size, kept up to date rather than summed on every write
+        self._size: int = self._db.execute(
+            "SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages"
+        ).fetchone()[0]
+
+        # Messages waiting to be written, and a lock so batches are written in order
+        self._pending: List[
+            Tuple[float, str, Any, int, Optional[str], Optional[str]]
+        ] = []
+        self._pending_condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        threading.Thread(target=self._writer, name="spool", daemon=True).start()
+
+    def append(
+        self,
+        topic: str,
+        payload: Any,
+        qos: int = 0,
+        content_type: Optional[str] = None,
+        user_properties: Optional[List[Tuple[str, str]]] = None,
+    ) -> None:
+        properties = json.dumps(user_properties) if user_properties else None
+        with self._pending_condition:
+            self._pending.append(
+                (time.time(), topic, payload, qos, content_type, properties)
+            )
+            self._pending_condition.notify()
+
+    def flush(self) -> None:
+        """Write pending messages to disk"""
+        with self._flush_lock:
+            with self._pending_condition:
+                batch, self._pending = self._pending, []
+            try:
+                self._write(batch)
+            except sqlite3.Error as error:
+                logger.error(f"Could not write {len(batch)} messages to spool: {error}")
+
+    def peek(self, limit: int = 100) -> List[SpooledMessage]:
+        """Return the oldest spooled messages with their ids, leaving them spooled
+
+        Messages are only removed once delivered, with `remove`.
+        """
+        self.flush()
+
+        with self._lock:
+            self._size -= self._expire()
+            rows = self._db.execute(
+                "SELECT id, topic, payload, qos, content_type, user_properties "
+                "FROM messages ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+        return [
+            SpooledMessage(
+                *row[:5],
+                [tuple(pair) for pair in json.loads(row[5])] if row[5] else None,
+            )
+            for row in rows
+        ]
+
+    def remove(self, ids: Sequence[int]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            with self._transaction():
+                freed = 0
+                for message_id in ids:
+                    row = self._db.execute(
+                        "SELECT LENGTH(payload) FROM messages WHERE id = ?",
+                        (message_id,),
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    self._db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                    freed += row[0] or 0
+            self._size -= freed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def _writer(self) -> None:
+        while True:
+            with self._pending_condition:
+                while not self._pending:
+                    self._pending_condition.wait()
+
+            # Give a burst of events a moment to arrive so they share a transaction
+            time.sleep(self.batch_interval)
+            self.flush()
+
+    def _write(
+        self, batch: List[Tuple[float, str, Any, int, Optional[str], Optional[str]]]
+    ) -> None:
+        if not batch:
+            return
+
+        with self._lock:
+            with self._transaction():
+                last_id = self._db.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM messages"
+                ).fetchone()[0]
+                self._db.executemany(
+                    "INSERT INTO messages "
+                    "(created, topic, payload, qos, content_type, user_properties) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                # Measured by SQLite, as LENGTH counts the characters of text
+                size = (
+                    self._size
+                    + self._db.execute(
+                        "SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM messages "
+                        "WHERE id > ?",
+                        (last_id,),
+                    ).fetchone()[0]
+                )
+                size -= self._expire()
+                size -= self._evict(size)
+            self._size = size
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # Called with _lock held
+        self._db.execute("BEGIN")
+        try:
+            yield
+            self._db.execute("COMMIT")
+        except sqlite3.Error:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            raise
+
+    def _expire(self) -> int:
+        """Delete messages older than max_age, returning the bytes freed
+
+        Messages are stored in the order they were created, so only the expired
+        ones are read rather than the whole spool.
+        """
+        # Called with _lock held
+        cutoff = time.time() - self.max_age
+        expired, freed = None, 0
+        cursor = self._db.execute(
+            "SELECT id, created, LENGTH(payload) FROM messages ORDER BY id"
+        )
+        for message_id, created, length in cursor:
+            if created >= cutoff:
+                break
+            expired, freed = message_id, freed + (length or 0)
+        cursor.close()
+
+        if expired is not None:
+            self._db.execute("DELETE FROM messages WHERE id <= ?", (expired,))
+        return freed
+
+    def _evict(self, size: int) -> int:
+        """Drop the oldest messages until `size` fits, returning the bytes freed"""
+        # Called with _lock held, inside a transaction
+        if size <= self.max_bytes:
+            return 0
+
+        dropped, freed, message_id = 0, 0, None
+        cursor = self._db.execute(
+            "SELECT id, LENGTH(payload) FROM messages ORDER BY id"
+        )
+        for message_id, length in cursor:
+            freed += length or 0
+            dropped += 1
+            if size - freed <= self.max_bytes:
+                break
+        cursor.close()
+        if message_id is None:
+            return 0
+
+        self._db.execute("DELETE FROM messages WHERE id <= ?", (message_id,))
+        logger.warning(f"Spool is full, dropped {dropped} oldest messages")
+        return freed
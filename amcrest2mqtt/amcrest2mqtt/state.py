@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from amcrest2mqtt.topics import OFF, ON
+from amcrest2mqtt.tracing import EventTrace
+
+
+logger = logging.getLogger(__name__)
+
+
+class StateTracker:
+    """Publishes binary sensor states only when they change
+
+    Topics with an off delay hold the off state back for that many seconds, so a Stop
+    quickly followed by another Start never reaches MQTT. An event trace given to
+    update is passed on to publish as `trace`, unless the state was delayed.
+
+    When publish returns a future which fails, the state is forgotten, so the next
+    update with the same state publishes it again.
+    """
+
+    def __init__(
+        self,
+        # Called as publish(topic, state), or publish(topic, state, trace=trace)
+        publish: Callable[..., Any],
+        off_delays: Optional[Dict[str, float]] = None,
+        on: Any = ON,
+        off: Any = OFF,
+    ) -> None:
+        self.publish = publish
+        self.off_delays = off_delays or {}
+        self.on = on
+        self.off = off
+        self.states: Dict[str, Any] = {}
+        self._pending_off: Dict[str, Tuple[asyncio.TimerHandle, Any]] = {}
+
+    def update(
+        self, topic: str, state: Any, trace: Optional[EventTrace] = None
+    ) -> None:
+        pending = self._pending_off.pop(topic, None)
+        if pending:
+            pending[0].cancel()
+
+        delay = self.off_delays.get(topic, 0)
+        if state == self.off and delay > 0 and self.states.get(topic) == self.on:
+            handle = asyncio.get_running_loop().call_later(
+                delay, self._set, topic, state
+            )
+            self._pending_off[topic] = (handle, state)
+            return
+
+        self._set(topic, state, trace)
+
+    def flush(self) -> None:
+        """Publish any delayed states immediately"""
+        pending, self._pending_off = self._pending_off, {}
+        for topic, (handle, state) in pending.items():
+            handle.cancel()
+            self._set(topic, state)
+
+    def _set(self, topic: str, state: Any, trace: Optional[EventTrace] = None) -> None:
+        self._pending_off.pop(topic, None)
+        if self.states.get(topic) == state:
+            return
+
+        self.states[topic] = state
+        if trace is None:
+            result = self.publish(topic, state)
+        else:
+            result = self.publish(topic, state, trace=trace)
+
+        if hasattr(result, "add_done_callback"):
+            loop = asyncio.get_running_loop()
+
+            def done(future: Any) -> None:
+                if not future.cancelled() and future.exception() is not None:
+                    # Resolved on the MQTT client's thread
+                    loop.call_soon_threadsafe(self._forget, topic, state)
+
+            result.add_done_callback(done)
+
+    def _forget(self, topic: str, state: Any) -> None:
+        if self.states.get(topic) == state:
+            del self.states[topic]
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from amcrest2mqtt.camera import CameraClient
+
+
+# Payloads published on every event are encoded once up front
+ON = b"on"
+OFF = b"off"
+ONLINE = b"online"
+OFFLINE = b"offline"
+
+HOME_ASSISTANT_ENTITIES = {
+    "doorbell": "binary_sensor",
+    "human": "binary_sensor",
+    "motion": "binary_sensor",
+    "storage_used": "sensor",
+    "storage_used_percent": "sensor",
+    "storage_total": "sensor",
+    "storage_health": "binary_sensor",
+    "version": "sensor",
+    "host": "sensor",
+    "serial_number": "sensor",
+    "snapshot": "camera",
+}
+
+# Entities which were once discovered under topics named after the device
+LEGACY_ENTITIES = (
+    "doorbell",
+    "human",
+    "motion",
+    "storage_used",
+    "storage_used_percent",
+    "storage_total",
+    "version",
+    "host",
+    "serial_number",
+)
+
+
+@dataclass(frozen=True)
+class Topics:
+    """MQTT topics for a camera, built once when the camera is set up"""
+
+    config: str
+    status: str
+    event: str
+    motion: str
+    doorbell: str
+    human: str
+    storage_used: str
+    storage_used_percent: str
+    storage_total: str
+    storage_health: str
+    snapshot: str
+    command: str
+    response: str
+    home_assistant: Mapping[str, str]
+    home_assistant_legacy: Mapping[str, str]
+
+    def __getitem__(self, name: str) -> Any:
+        return getattr(self, name)
+
+    @classmethod
+    def for_camera(cls, camera: CameraClient, home_assistant_prefix: str) -> "Topics":
+        base = f"amcrest2mqtt/{camera.serial_number}"
+        discovery = f"amcrest2mqtt-{camera.serial_number}"
+
+        return cls(
+            config=f"{base}/config",
+            status=f"{base}/status",
+            event=f"{base}/event",
+            motion=f"{base}/motion",
+            doorbell=f"{base}/doorbell",
+            human=f"{base}/human",
+            storage_used=f"{base}/storage/used",
+            storage_used_percent=f"{base}/storage/used_percent",
+            storage_total=f"{base}/storage/total",
+            storage_health=f"{base}/storage/health",
+            snapshot=f"{base}/snapshot",
+            command=f"{base}/command",
+            response=f"{base}/response",
+            home_assistant=MappingProxyType(
+                {
+                    entity: f"{home_assistant_prefix}/{component}/{discovery}/{entity}/config"
+                    for entity, component in HOME_ASSISTANT_ENTITIES.items()
+                }
+            ),
+            home_assistant_legacy=MappingProxyType(
+                {
+                    entity: f"{home_assistant_prefix}/{HOME_ASSISTANT_ENTITIES[entity]}/{discovery}/{camera.device_slug}_{entity}/config"
+                    for entity in LEGACY_ENTITIES
+                }
+            ),
+        )
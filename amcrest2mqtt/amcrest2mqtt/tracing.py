@@ -0,0 +1,34 @@
+import time
+from typing import Any, Dict, Optional
+
+
+class EventTrace:
+    """Timestamps of a camera event on its way through the bridge
+
+    Created as soon as the event is received from the camera, then handed to every
+    publish the event causes so MqttClient can time serialization and the broker ack.
+    """
+
+    __slots__ = ("received", "received_at", "routed")
+
+    def __init__(self) -> None:
+        self.received = time.monotonic()
+        # Wall clock time, to compare against the camera's own clock or a consumer's
+        self.received_at = time.time()
+        self.routed: Optional[float] = None
+
+    def mark_routed(self) -> float:
+        """Record that sensor states have been derived, returns the time it took"""
+        self.routed = time.monotonic()
+        return self.routed - self.received
+
+    def since_received(self) -> float:
+        return time.monotonic() - self.received
+
+    def as_fields(self) -> Dict[str, Any]:
+        """Timings to attach to the event payload"""
+        fields: Dict[str, Any] = {"received_at": round(self.received_at, 6)}
+        if self.routed is not None:
+            fields["route_ms"] = round((self.routed - self.received) * 1000, 3)
+        fields["publish_ms"] = round(self.since_received() * 1000, 3)
+        return fields
@@ -1,6 +1,26 @@
 import functools
+import random
 
 
 @functools.lru_cache()
 def to_gb(total: float) -> str:
     return str(round(total / 1024 / 1024 / 1024, 2))
+
+
+class Backoff:
+    """Exponential backoff with jitter"""
+
+    def __init__(self, initial: float, maximum: float, factor: float = 2) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self) -> float:
+        delay = min(self.maximum, self.initial * self.factor**self.attempts)
+        self.attempts += 1
+        # Spread retries over the upper half of the window so they don't line up
+        return random.uniform(delay / 2, delay)
+
+    def reset(self) -> None:
+        self.attempts = 0
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Optional
+
+from amcrest import AmcrestError
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.metrics import Metrics
+from amcrest2mqtt.recording import Event
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventWatchdog:
+    """Detects event streams which died without their connection closing
+
+    A camera dropping off the network leaves its event stream hanging until the TCP
+    connection times out, which can take hours. Once no event arrived for `interval`
+    seconds, the camera is probed with a cheap HTTP call every `interval` seconds,
+    and a probe failing within `timeout` seconds ends the stream with an
+    AmcrestError. A stream silent for `resubscribe_after` seconds while the camera
+    answers is reopened, in case the camera dropped the subscription.
+
+    The stream is watched from a separate task, which interrupts the read of the
+    next event, so events themselves pay for little more than a timestamp.
+    """
+
+    def __init__(
+        self,
+        camera: CameraClient,
+        subscribe: Callable[[], AsyncIterator[Event]],
+        interval: float,
+        timeout: float,
+        resubscribe_after: float = 0,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.camera = camera
+        self.subscribe = subscribe
+        self.interval = interval
+        self.timeout = timeout
+        self.resubscribe_after = resubscribe_after
+        self.metrics = metrics
+
+        self._last_event = 0.0
+        # Whether the stream is being read, rather than an event being handled
+        self._reading = False
+        # Set when the monitor interrupts the read, along with the error to end the
+        # stream with, or None to resubscribe
+        self._interrupted = False
+        self._error: Optional[AmcrestError] = None
+
+    async def events(self) -> AsyncIterator[Event]:
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+
+        while True:
+            stream = self.subscribe()
+            self._last_event = loop.time()
+            self._interrupted = False
+            self._error = None
+            monitor = asyncio.ensure_future(self._monitor(task))
+            try:
+                while True:
+                    self._reading = True
+                    try:
+                        event = await anext(stream)
+                    except StopAsyncIteration:
+                        return
+                    except asyncio.CancelledError:
+                        if not self._interrupted:
+                            raise
+                        if hasattr(task, "uncancel"):
+                            task.uncancel()
+                        break
+                    finally:
+                        self._reading = False
+
+                    self._last_event = loop.time()
+                    yield event
+            finally:
+                monitor.cancel()
+                await stream.aclose()
+
+            if self._error is not None:
+                raise self._error
+
+            logger.info(f"Resubscribing to events on {self.camera.host}...")
+            if self.metrics is not None:
+                self.metrics.reconnects.inc(f"{self.camera.host}/events")
+
+    async def _monitor(self, task: asyncio.Task) -> None:
+        loop = asyncio.get_running_loop()
+        delay = self.interval
+
+        while True:
+            await asyncio.sleep(delay)
+            silent = loop.time() - self._last_event
+            if silent < self.interval:
+                delay = self.interval - silent
+                continue
+
+            # Events may be held up by the broker rather than the camera
+            delay = self.interval
+            if not self._reading:
+                continue
+
+            logger.debug(f"No events from {self.camera.host} for {silent:.0f}s")
+            error = None
+            try:
+                await self.camera.probe(self.timeout)
+            except AmcrestError as probe_error:
+                error = AmcrestError(
+                    f"Camera stopped answering after {silent:.0f}s without events: "
+                    f"{probe_error}"
+                )
+
+            if error is None and not 0 < self.resubscribe_after <= silent:
+                continue
+            # Only interrupt a read which is still waiting, an event may have come
+            # in while probing. One which arrived just now has its reader's wakeup
+            # queued already, so let it run first, as cancelling it would lose it
+            await asyncio.sleep(0)
+            if self._reading and loop.time() - self._last_event >= silent:
+                self._error = error
+                self._interrupted = True
+                task.cancel()
+                return
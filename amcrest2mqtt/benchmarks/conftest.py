@@ -0,0 +1,17 @@
+import pytest
+
+from tests.fakes import FakeBroker, FakeCamera
+
+
+@pytest.fixture
+def broker():
+    broker = FakeBroker()
+    yield broker
+    broker.close()
+
+
+@pytest.fixture
+def camera():
+    camera = FakeCamera(events=1000)
+    yield camera
+    camera.close()
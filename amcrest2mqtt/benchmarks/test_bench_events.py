@@ -0,0 +1,182 @@
+"""Benchmarks for the event hot path and startup, against local fakes
+
+Run with `pytest benchmarks`, they are skipped unless pytest-benchmark (a dev
+dependency) is installed.
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import replace
+from typing import Dict, List
+
+import pytest
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.config import Settings
+from amcrest2mqtt.main import poll_device
+from amcrest2mqtt.mqtt import MqttClient
+from amcrest2mqtt.topics import ONLINE, Topics
+from tests.fakes import FakeBroker, FakeCamera, Message
+
+pytest.importorskip("pytest_benchmark")
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    cuts = statistics.quantiles(latencies, n=100)
+    return {"p50_ms": cuts[49] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+def bridge_events(
+    camera: FakeCamera,
+    broker: FakeBroker,
+    transport: str = "thread",
+    protocol: str = "3.1.1",
+) -> List[Message]:
+    """Run poll_device until every event from the camera reached the broker"""
+    settings = replace(Settings.from_env(), mqtt_host="127.0.0.1")
+    broker.clear()
+
+    async def run() -> List[Message]:
+        mqtt_client = MqttClient(
+            host="127.0.0.1", port=broker.port, transport=transport, protocol=protocol
+        )
+        client = CameraClient("127.0.0.1", str(camera.port), "admin", "password")
+        await client.load_details()
+        topics = Topics.for_camera(client, settings.home_assistant_prefix)
+
+        task = asyncio.ensure_future(poll_device(client, mqtt_client, topics, settings))
+        loop = asyncio.get_running_loop()
+        try:
+            received = await loop.run_in_executor(
+                None,
+                broker.wait_for,
+                lambda: broker.counts[topics.event] >= camera.events,
+            )
+            assert received, "Timed out waiting for events"
+        finally:
+            task.cancel()
+            mqtt_client.client.disconnect()
+            mqtt_client.client.loop_stop()
+
+        return broker.topic(topics.event)
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("protocol", ["3.1.1", "5"])
+@pytest.mark.parametrize("transport", ["thread", "asyncio"])
+def test_event_throughput(
+    benchmark, camera: FakeCamera, broker: FakeBroker, transport: str, protocol: str
+):
+    messages = benchmark.pedantic(
+        bridge_events,
+        args=(camera, broker, transport, protocol),
+        rounds=3,
+        iterations=1,
+    )
+
+    benchmark.extra_info["events"] = len(messages)
+    benchmark.extra_info["events_per_second"] = (
+        len(messages) / benchmark.stats.stats.mean
+    )
+    # Bytes of every PUBLISH, sensor states included, the broker parsed per event
+    benchmark.extra_info["publish_bytes_per_event"] = broker.publish_bytes / len(
+        messages
+    )
+
+
+def test_event_latency(benchmark, broker: FakeBroker):
+    # A steady rate well below saturation, so queueing doesn't dominate the latency
+    camera = FakeCamera(events=500, rate=200)
+    try:
+        messages = benchmark.pedantic(
+            bridge_events, args=(camera, broker), rounds=1, iterations=1
+        )
+    finally:
+        camera.close()
+
+    latencies = [
+        message.received - camera.sent[json.loads(message.payload)["data"]["Index"]]
+        for message in messages
+    ]
+    benchmark.extra_info.update(percentiles(latencies))
+
+
+def start_main(
+    camera: FakeCamera, broker: FakeBroker, cache_dir: str, qos: int = 0
+) -> Dict[str, float]:
+    """Start the app through main() and time its first status and event publishes"""
+    env = os.environ | {
+        "AMCREST_HOST": "127.0.0.1",
+        "AMCREST_PORT": str(camera.port),
+        "AMCREST_PASSWORD": "password",
+        "MQTT_HOST": "127.0.0.1",
+        "MQTT_PORT": str(broker.port),
+        "MQTT_USERNAME": "bench",
+        "HOME_ASSISTANT": "true",
+        "CACHE_DIR": cache_dir,
+        "MQTT_QOS": str(qos),
+    }
+    status = "amcrest2mqtt/BENCH0001/status"
+    event = "amcrest2mqtt/BENCH0001/event"
+    broker.clear()
+
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "amcrest2mqtt.main"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        assert broker.wait_for(
+            lambda: broker.counts[status]
+        ), "Timed out waiting for the device to come online"
+        assert broker.wait_for(
+            lambda: broker.counts[event]
+        ), "Timed out waiting for the first event"
+    finally:
+        process.kill()
+        process.wait()
+
+    online = next(m for m in broker.topic(status) if m.payload == ONLINE)
+    first_event = broker.topic(event)[0]
+    return {
+        "online_s": online.received - started,
+        "first_event_s": first_event.received - started,
+    }
+
+
+@pytest.mark.parametrize(
+    "cached,ack_delay",
+    [(False, 0), (True, 0), (True, 0.05)],
+    ids=["cold", "cached", "slow-broker"],
+)
+def test_startup(
+    benchmark, broker: FakeBroker, tmp_path, cached: bool, ack_delay: float
+):
+    """Time to the device being online and to its first event
+
+    With a slow broker, acks for the QoS 1 startup messages take `ack_delay` each.
+    """
+    camera = FakeCamera(events=1)
+    cache_dir = str(tmp_path) if cached else ""
+    qos = 1 if ack_delay else 0
+    if cached:
+        start_main(camera, broker, cache_dir, qos)
+
+    broker.ack_delay = ack_delay
+    try:
+        timings = benchmark.pedantic(
+            start_main, args=(camera, broker, cache_dir, qos), rounds=3, iterations=1
+        )
+    finally:
+        broker.ack_delay = 0
+        camera.close()
+
+    benchmark.extra_info.update(timings)
@@ -1,14 +1,44 @@
 import asyncio
 import logging
 import os
-from typing import Any, Dict
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import replace
+from typing import AsyncIterator, Dict, Optional
 
 from amcrest import AmcrestError
 
 from amcrest2mqtt import __version__
+from amcrest2mqtt.cache import FileCache
 from amcrest2mqtt.camera import CameraClient
-from amcrest2mqtt.mqtt import MqttClient
-from amcrest2mqtt.util import to_gb
+from amcrest2mqtt.commands import CommandDispatcher
+from amcrest2mqtt.config import DeviceConfig, Settings, load_devices
+from amcrest2mqtt.discovery import (
+    DiscoveryStore,
+    discovery_messages,
+    pending_discovery,
+    record_discovery,
+)
+from amcrest2mqtt.encoding import get_encoding, get_json_serializer, get_projection
+from amcrest2mqtt.metrics import Metrics
+from amcrest2mqtt.mqtt import MqttClient, MqttMessage
+from amcrest2mqtt.policy import PublishPolicies
+from amcrest2mqtt.recording import (
+    Event,
+    EventRecorder,
+    read_header,
+    record_events,
+    replay_events,
+)
+from amcrest2mqtt.router import EventRouter
+from amcrest2mqtt.sensors import SensorScheduler
+from amcrest2mqtt.snapshot import SnapshotFetcher
+from amcrest2mqtt.spool import Spool
+from amcrest2mqtt.state import StateTracker
+from amcrest2mqtt.topics import OFFLINE, ON, ONLINE, Topics
+from amcrest2mqtt.tracing import EventTrace
+from amcrest2mqtt.util import Backoff
+from amcrest2mqtt.watchdog import EventWatchdog
 
 
 logger = logging.getLogger(__name__)
@@ -20,339 +50,555 @@ def main() -> None:
 
     logger.info(f"App Version: {__version__}")
 
-    amcrest_host = os.getenv("AMCREST_HOST")
-    amcrest_port = os.getenv("AMCREST_PORT", "80")
-    amcrest_username = os.getenv("AMCREST_USERNAME", "admin")
-    amcrest_password = os.getenv("AMCREST_PASSWORD")
+    settings = Settings.from_env()
+    # Replaying recordings doesn't need any cameras
+    devices = [] if settings.event_replay else load_devices()
 
-    storage_poll_interval = int(os.getenv("STORAGE_POLL_INTERVAL", 3600))
-
-    mqtt_host = os.getenv("MQTT_HOST") or "localhost"
-    mqtt_qos = os.getenv("MQTT_QOS", "0")
-    mqtt_port = os.getenv("MQTT_PORT", "1883")
-    mqtt_username = os.getenv("MQTT_USERNAME")
-    mqtt_password = os.getenv("MQTT_PASSWORD")  # can be None
-    mqtt_tls_enabled = os.getenv("MQTT_TLS_ENABLED") == "true"
-    mqtt_tls_ca_cert = os.getenv("MQTT_TLS_CA_CERT")
-    mqtt_tls_cert = os.getenv("MQTT_TLS_CERT")
-    mqtt_tls_key = os.getenv("MQTT_TLS_KEY")
-
-    home_assistant = os.getenv("HOME_ASSISTANT") == "true"
-    home_assistant_prefix = os.getenv("HOME_ASSISTANT_PREFIX") or "homeassistant"
-
-    camera = CameraClient(
-        host=amcrest_host,
-        port=amcrest_port,
-        username=amcrest_username,
-        password=amcrest_password,
-    )
+    metrics = None
+    if settings.metrics_port:
+        metrics = Metrics()
+        metrics.serve(settings.metrics_port)
 
     mqtt_client = MqttClient(
-        host=mqtt_host,
-        port=int(mqtt_port),
-        username=mqtt_username,
-        password=mqtt_password,
+        host=settings.mqtt_host,
+        port=settings.mqtt_port,
+        username=settings.mqtt_username,
+        password=settings.mqtt_password,
+        serializer=get_json_serializer(settings.json_serializer),
+        buffer_size=settings.mqtt_buffer_size,
+        reconnect_min_delay=settings.mqtt_reconnect_min_delay,
+        reconnect_max_delay=settings.mqtt_reconnect_max_delay,
+        spool=(
+            Spool(
+                settings.spool_path,
+                max_bytes=settings.spool_max_bytes,
+                max_age=settings.spool_max_age,
+            )
+            if settings.spool_path
+            else None
+        ),
+        metrics=metrics,
+        transport=settings.mqtt_transport,
+        max_inflight=settings.mqtt_max_inflight,
+        policies=PublishPolicies(
+            settings.publish_policies, settings.home_assistant_prefix
+        ),
+        protocol=settings.mqtt_version,
     )
 
-    # MQTT topics
-    topics = {
-        "config": f"amcrest2mqtt/{camera.serial_number}/config",
-        "status": f"amcrest2mqtt/{camera.serial_number}/status",
-        "event": f"amcrest2mqtt/{camera.serial_number}/event",
-        "motion": f"amcrest2mqtt/{camera.serial_number}/motion",
-        "doorbell": f"amcrest2mqtt/{camera.serial_number}/doorbell",
-        "human": f"amcrest2mqtt/{camera.serial_number}/human",
-        "storage_used": f"amcrest2mqtt/{camera.serial_number}/storage/used",
-        "storage_used_percent": f"amcrest2mqtt/{camera.serial_number}/storage/used_percent",
-        "storage_total": f"amcrest2mqtt/{camera.serial_number}/storage/total",
-        "home_assistant_legacy": {
-            "doorbell": f"{home_assistant_prefix}/binary_sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_doorbell/config",
-            "human": f"{home_assistant_prefix}/binary_sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_human/config",
-            "motion": f"{home_assistant_prefix}/binary_sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_motion/config",
-            "storage_used": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_storage_used/config",
-            "storage_used_percent": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_storage_used_percent/config",
-            "storage_total": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_storage_total/config",
-            "version": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_version/config",
-            "host": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_host/config",
-            "serial_number": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/{camera.device_slug}_serial_number/config",
-        },
-        "home_assistant": {
-            "doorbell": f"{home_assistant_prefix}/binary_sensor/amcrest2mqtt-{camera.serial_number}/doorbell/config",
-            "human": f"{home_assistant_prefix}/binary_sensor/amcrest2mqtt-{camera.serial_number}/human/config",
-            "motion": f"{home_assistant_prefix}/binary_sensor/amcrest2mqtt-{camera.serial_number}/motion/config",
-            "storage_used": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/storage_used/config",
-            "storage_used_percent": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/storage_used_percent/config",
-            "storage_total": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/storage_total/config",
-            "version": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/version/config",
-            "host": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/host/config",
-            "serial_number": f"{home_assistant_prefix}/sensor/amcrest2mqtt-{camera.serial_number}/serial_number/config",
-        },
-    }
+    # All devices share one MQTT connection and one executor for camera calls
+    executor = ThreadPoolExecutor(
+        max_workers=max(len(devices), 1) * settings.amcrest_max_workers,
+        thread_name_prefix="amcrest",
+    )
+    status_topics: Dict[str, str] = {}
+    # Snapshots are fetched on the same executor, so keep them from hogging it
+    snapshot_limit = asyncio.Semaphore(settings.snapshot_max_concurrent)
+    # Commands for every device share one pool of workers
+    commands = None
+    if settings.commands:
+        commands = CommandDispatcher(
+            mqtt_client, settings.command_workers, settings.command_queue_size
+        )
 
-    # Configure Home Assistant
-    if home_assistant:
-        logger.info("Writing Home Assistant discovery config...")
-
-        base_config = {
-            "availability_topic": topics["status"],
-            "qos": mqtt_qos,
-            "device": {
-                "name": f"Amcrest {camera.device_type}",
-                "manufacturer": "Amcrest",
-                "model": camera.device_type,
-                "identifiers": camera.serial_number,
-                "sw_version": camera.amcrest_version,
-                "via_device": "amcrest2mqtt",
-            },
-        }
+    loop = asyncio.get_event_loop()
 
-        if camera.is_doorbell:
+    # Home Assistant announces itself when it starts, so send fresh snapshots again
+    # for its cameras
+    snapshot_fetchers: Dict[str, SnapshotFetcher] = {}
+    if settings.home_assistant and settings.snapshots:
+        mqtt_client.subscribe(
+            f"{settings.home_assistant_prefix}/status",
+            lambda message: loop.call_soon_threadsafe(
+                republish_snapshots, snapshot_fetchers, message.payload
+            ),
+        )
 
-            mqtt_client.publish(
-                topic=topics["home_assistant_legacy"]["doorbell"], payload=""
+    try:
+        if metrics is not None:
+            asyncio.ensure_future(metrics.monitor_loop_lag())
+        if commands is not None:
+            asyncio.ensure_future(commands.run())
+
+        if settings.event_replay:
+            asyncio.ensure_future(
+                replay_recordings(settings, mqtt_client, executor, status_topics)
             )
-            mqtt_client.publish(
-                topic=topics["home_assistant"]["doorbell"],
-                payload=base_config
-                | {
-                    "state_topic": topics["doorbell"],
-                    "payload_on": "on",
-                    "payload_off": "off",
-                    "icon": "mdi:doorbell",
-                    "name": camera.name,
-                    "unique_id": f"{camera.serial_number}.doorbell",
-                },
-                as_json=True,
+
+        logger.info(f"Starting {len(devices)} device(s)...")
+        for device in devices:
+            asyncio.ensure_future(
+                supervise_device(
+                    device=device,
+                    settings=settings,
+                    mqtt_client=mqtt_client,
+                    executor=executor,
+                    status_topics=status_topics,
+                    metrics=metrics,
+                    snapshot_limit=snapshot_limit,
+                    commands=commands,
+                    snapshot_fetchers=snapshot_fetchers,
+                )
             )
+        loop.run_forever()
+    except KeyboardInterrupt:
+        loop.close()
+        logger.debug("Received KeyboardInterrupt, exitting...")
+        mqtt_client.exit_gracefully(topics=list(status_topics.values()), rc=0)
+        os._exit(1)
 
-        if camera.is_ad410:
-            mqtt_client.publish(
-                topic=topics["home_assistant_legacy"]["human"], payload=""
+
+async def supervise_device(
+    device: DeviceConfig,
+    settings: Settings,
+    mqtt_client: MqttClient,
+    executor: Executor,
+    status_topics: Dict[str, str],
+    metrics: Optional[Metrics] = None,
+    snapshot_limit: Optional[asyncio.Semaphore] = None,
+    commands: Optional[CommandDispatcher] = None,
+    snapshot_fetchers: Optional[Dict[str, SnapshotFetcher]] = None,
+) -> None:
+    """Run a device, restarting it on failure without affecting other devices"""
+
+    backoff = Backoff(settings.device_restart_delay, settings.device_restart_max_delay)
+    # Calls to a hung camera hold their worker past a restart, so they keep counting
+    # against the camera's limit
+    camera_limit = asyncio.Semaphore(settings.amcrest_max_workers)
+
+    while True:
+        started = time.monotonic()
+        try:
+            await run_device(
+                device,
+                settings,
+                mqtt_client,
+                executor,
+                status_topics,
+                metrics,
+                snapshot_limit,
+                commands,
+                camera_limit,
+                snapshot_fetchers,
             )
+        except AmcrestError as error:
+            logger.error(f"Amcrest error on {device.host}: {error}")
+        except Exception:
+            logger.exception(f"Unexpected error on {device.host}")
+
+        if device.host in status_topics:
             mqtt_client.publish(
-                topic=topics["home_assistant"]["human"],
-                payload=base_config
-                | {
-                    "state_topic": topics["human"],
-                    "payload_on": "on",
-                    "payload_off": "off",
-                    "device_class": "motion",
-                    "name": f"{camera.name} Human",
-                    "unique_id": f"{camera.serial_number}.human",
-                },
-                as_json=True,
+                topic=status_topics[device.host], payload=OFFLINE, exit_on_error=False
             )
 
-        mqtt_client.publish(topic=topics["home_assistant_legacy"]["motion"], payload="")
-        mqtt_client.publish(
-            topic=topics["home_assistant"]["motion"],
-            payload=base_config
-            | {
-                "state_topic": topics["motion"],
-                "payload_on": "on",
-                "payload_off": "off",
-                "device_class": "motion",
-                "name": f"{camera.name} Motion",
-                "unique_id": f"{camera.serial_number}.motion",
-            },
-            as_json=True,
-        )
+        # A device which ran for a while had recovered, so start backing off afresh
+        if time.monotonic() - started > settings.device_restart_max_delay:
+            backoff.reset()
 
-        mqtt_client.publish(
-            topic=topics["home_assistant_legacy"]["version"], payload=""
-        )
-        mqtt_client.publish(
-            topic=topics["home_assistant"]["version"],
-            payload=base_config
-            | {
-                "state_topic": topics["config"],
-                "value_template": "{{ value_json.sw_version }}",
-                "icon": "mdi:package-up",
-                "name": f"{camera.name} Version",
-                "unique_id": f"{camera.serial_number}.version",
-                "entity_category": "diagnostic",
-                "enabled_by_default": False,
-            },
-            as_json=True,
-        )
+        delay = backoff.next()
+        logger.info(f"Restarting {device.host} in {delay:.1f} seconds...")
+        await asyncio.sleep(delay)
+        if metrics is not None:
+            metrics.reconnects.inc(device.host)
 
-        mqtt_client.publish(
-            topic=topics["home_assistant_legacy"]["serial_number"], payload=""
-        )
-        mqtt_client.publish(
-            topic=topics["home_assistant"]["serial_number"],
-            payload=base_config
-            | {
-                "state_topic": topics["config"],
-                "value_template": "{{ value_json.serial_number }}",
-                "icon": "mdi:alphabetical-variant",
-                "name": f"{camera.name} Serial Number",
-                "unique_id": f"{camera.serial_number}.serial_number",
-                "entity_category": "diagnostic",
-                "enabled_by_default": False,
-            },
-            as_json=True,
-        )
 
-        mqtt_client.publish(topic=topics["home_assistant_legacy"]["host"], payload="")
-        mqtt_client.publish(
-            topic=topics["home_assistant"]["host"],
-            payload=base_config
-            | {
-                "state_topic": topics["config"],
-                "value_template": "{{ value_json.host }}",
-                "icon": "mdi:ip-network",
-                "name": f"{camera.name} Host",
-                "unique_id": f"{camera.serial_number}.host",
-                "entity_category": "diagnostic",
-                "enabled_by_default": False,
-            },
-            as_json=True,
+async def run_device(
+    device: DeviceConfig,
+    settings: Settings,
+    mqtt_client: MqttClient,
+    executor: Executor,
+    status_topics: Dict[str, str],
+    metrics: Optional[Metrics] = None,
+    snapshot_limit: Optional[asyncio.Semaphore] = None,
+    commands: Optional[CommandDispatcher] = None,
+    camera_limit: Optional[asyncio.Semaphore] = None,
+    snapshot_fetchers: Optional[Dict[str, SnapshotFetcher]] = None,
+) -> None:
+    """Set up a device and listen for its events until the event stream fails
+
+    The event stream is opened as soon as the camera details are known, with
+    discovery, config and the online status published alongside it, so events
+    aren't missed while the broker acknowledges the startup messages.
+    """
+
+    started = time.monotonic()
+    camera = CameraClient(
+        host=device.host,
+        port=device.port,
+        username=device.username,
+        password=device.password,
+        timeout=settings.amcrest_timeout,
+        max_workers=settings.amcrest_max_workers,
+        executor=executor,
+        metrics=metrics,
+        limit=camera_limit,
+    )
+    topics: Optional[Topics] = None
+    snapshots: Optional[SnapshotFetcher] = None
+    tasks = []
+    background = []
+    try:
+        cache = FileCache(settings.cache_dir)
+        cached_details = await camera.load_details(cache)
+        if metrics is not None:
+            metrics.startup.observe(time.monotonic() - started, "details")
+
+        topics = Topics.for_camera(camera, settings.home_assistant_prefix)
+        status_topics[device.host] = topics.status
+        # Shared by snapshot triggers and commands, so a fetch in flight serves both
+        snapshots = SnapshotFetcher(
+            camera,
+            lambda image: mqtt_client.publish(
+                topic=topics.snapshot, payload=image, content_type="image/jpeg"
+            ),
+            snapshot_limit,
+            settings.snapshot_max_age,
         )
+        if snapshot_fetchers is not None:
+            snapshot_fetchers[device.host] = snapshots
+        if commands is not None:
+            commands.add_device(camera, topics, snapshots)
 
-        if storage_poll_interval > 0:
-            mqtt_client.publish(
-                topic=topics["home_assistant_legacy"]["storage_used_percent"],
-                payload="",
-            )
-            mqtt_client.publish(
-                topics["home_assistant"]["storage_used_percent"],
-                payload=base_config
-                | {
-                    "state_topic": topics["storage_used_percent"],
-                    "unit_of_measurement": "%",
-                    "icon": "mdi:micro-sd",
-                    "name": f"{camera.name} Storage Used %",
-                    "object_id": f"{camera.device_slug}_storage_used_percent",
-                    "unique_id": f"{camera.serial_number}.storage_used_percent",
-                    "entity_category": "diagnostic",
-                },
-                as_json=True,
+        discovery_store = DiscoveryStore(
+            cache, f"discovery_{settings.mqtt_host}_{camera.serial_number}"
+        )
+        background.append(
+            asyncio.ensure_future(
+                publish_startup(
+                    camera,
+                    mqtt_client,
+                    topics,
+                    settings,
+                    cache,
+                    discovery_store,
+                    cached_details,
+                )
             )
+        )
 
-            mqtt_client.publish(
-                topic=topics["home_assistant_legacy"]["storage_used"], payload=""
+        logger.info(f"Listening for events on {device.host}...")
+        tasks.append(
+            asyncio.ensure_future(
+                poll_device(
+                    camera=camera,
+                    mqtt_client=mqtt_client,
+                    topics=topics,
+                    settings=settings,
+                    metrics=metrics,
+                    snapshots=snapshots,
+                    started=started,
+                )
             )
-            mqtt_client.publish(
-                topic=topics["home_assistant"]["storage_used"],
-                payload=base_config
-                | {
-                    "state_topic": topics["storage_used"],
-                    "unit_of_measurement": "GB",
-                    "icon": "mdi:micro-sd",
-                    "name": f"{camera.name} Storage Used",
-                    "unique_id": f"{camera.serial_number}.storage_used",
-                    "entity_category": "diagnostic",
-                },
-                as_json=True,
+        )
+        if any(interval > 0 for interval in settings.poll_intervals.values()):
+            scheduler = SensorScheduler(
+                camera,
+                topics,
+                publish_many=mqtt_client.publish_many,
+                intervals=settings.poll_intervals,
+                jitter=settings.poll_jitter,
             )
+            tasks.append(asyncio.ensure_future(scheduler.run()))
+
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+        raise AmcrestError("Event stream ended")
+    finally:
+        for task in tasks + background:
+            task.cancel()
+        if snapshots is not None:
+            snapshots.cancel()
+            if snapshot_fetchers is not None:
+                snapshot_fetchers.pop(device.host, None)
+        if commands is not None and topics is not None:
+            commands.remove_device(topics)
+
+
+def republish_snapshots(
+    snapshot_fetchers: Dict[str, SnapshotFetcher], payload: bytes
+) -> None:
+    """Publish fresh snapshots again once Home Assistant is back online"""
+    if payload == b"online":
+        for snapshots in snapshot_fetchers.values():
+            snapshots.republish()
 
-            mqtt_client.publish(
-                topic=topics["home_assistant_legacy"]["storage_total"], payload=""
-            )
-            mqtt_client.publish(
-                topic=topics["home_assistant"]["storage_total"],
-                payload=base_config
-                | {
-                    "state_topic": topics["storage_total"],
-                    "unit_of_measurement": "GB",
-                    "icon": "mdi:micro-sd",
-                    "name": f"{camera.name} Storage Total",
-                    "unique_id": f"{camera.serial_number}.storage_total",
-                    "entity_category": "diagnostic",
-                },
-                as_json=True,
-            )
 
-    # Main loop
-    mqtt_client.publish(topic=topics["status"], payload="online")
-    mqtt_client.publish(
-        topic=topics["config"],
-        payload={
-            "version": camera.version,
-            "device_type": camera.device_type,
-            "device_name": camera.name,
-            "sw_version": camera.amcrest_version,
-            "serial_number": camera.serial_number,
-            "host": amcrest_host,
-        },
-        as_json=True,
-    )
+async def publish_startup(
+    camera: CameraClient,
+    mqtt_client: MqttClient,
+    topics: Topics,
+    settings: Settings,
+    cache: FileCache,
+    discovery_store: DiscoveryStore,
+    cached_details: bool,
+) -> None:
+    """Publish config while a device starts listening, then refresh cached details"""
 
-    loop = asyncio.get_event_loop()
+    await publish_config(camera, mqtt_client, topics, settings, discovery_store)
 
-    logger.info("Listening for events...")
-    try:
-        if storage_poll_interval > 0:
-            asyncio.ensure_future(refresh_storage_sensors(camera, mqtt_client, topics))
-        asyncio.ensure_future(
-            poll_device(camera=camera, mqtt_client=mqtt_client, topics=topics)
+    # Cached details let us listen for events straight away, refresh them afterwards
+    if cached_details:
+        await refresh_details(
+            camera, mqtt_client, topics, settings, cache, discovery_store
         )
-        loop.run_forever()
-    except KeyboardInterrupt:
-        loop.close()
-        logger.debug("Received KeyboardInterrupt, exitting...")
-        mqtt_client.exit_gracefully(topic=topics["status"], rc=0)
-        os._exit(1)
 
 
-async def poll_device(
-    camera: CameraClient, mqtt_client: MqttClient, topics: Dict[str, str]
+async def replay_recordings(
+    settings: Settings,
+    mqtt_client: MqttClient,
+    executor: Executor,
+    status_topics: Dict[str, str],
 ) -> None:
+    """Replay recorded event streams through the bridge, then exit"""
+
+    logger.info(
+        f"Replaying {len(settings.event_replay)} recording(s) at "
+        f"{settings.event_replay_speed or 'maximum'}x speed..."
+    )
     try:
-        async for code, payload in camera.client.async_event_actions("All"):
-            if (camera.is_ad110 and code == "ProfileAlarmTransmit") or (
-                code == "VideoMotion" and not camera.is_ad110
-            ):
-                motion_payload = "on" if payload["action"] == "Start" else "off"
-                mqtt_client.publish(topic=topics["motion"], payload=motion_payload)
-            elif (
-                code == "CrossRegionDetection"
-                and payload["data"]["ObjectType"] == "Human"
-            ):
-                human_payload = "on" if payload["action"] == "Start" else "off"
-                mqtt_client.publish(topic=topics["human"], payload=human_payload)
-            elif code == "_DoTalkAction_":
-                doorbell_payload = (
-                    "on" if payload["data"]["Action"] == "Invite" else "off"
-                )
-                mqtt_client.publish(topic=topics["doorbell"], payload=doorbell_payload)
+        await asyncio.gather(
+            *(
+                replay_device(path, settings, mqtt_client, executor, status_topics)
+                for path in settings.event_replay
+            )
+        )
+        logger.info("Replay finished")
+        rc = 0
+    except Exception:
+        logger.exception("Replay failed")
+        rc = 1
 
-            mqtt_client.publish(topic=topics["event"], payload=payload, as_json=True)
-            logger.debug(str(payload))
+    mqtt_client.exit_gracefully(topics=list(status_topics.values()), rc=rc)
 
+
+async def replay_device(
+    path: str,
+    settings: Settings,
+    mqtt_client: MqttClient,
+    executor: Executor,
+    status_topics: Dict[str, str],
+) -> None:
+    """Publish a recorded camera and feed its events through poll_device"""
+
+    header = read_header(path)
+    # There is no camera to take snapshots from
+    settings = replace(settings, snapshots=False)
+
+    # The camera is never contacted, its details come from the recording
+    camera = CameraClient(
+        host=header["host"],
+        port="80",
+        username="admin",
+        password="replay",
+        executor=executor,
+    )
+    camera.details = header["details"]
+
+    topics = Topics.for_camera(camera, settings.home_assistant_prefix)
+    status_topics[path] = topics.status
+
+    discovery_store = DiscoveryStore(
+        FileCache(settings.cache_dir),
+        f"discovery_{settings.mqtt_host}_{camera.serial_number}",
+    )
+    await publish_config(camera, mqtt_client, topics, settings, discovery_store)
+
+    await poll_device(
+        camera=camera,
+        mqtt_client=mqtt_client,
+        topics=topics,
+        settings=settings,
+        events=replay_events(path, settings.event_replay_speed),
+    )
+
+
+async def refresh_details(
+    camera: CameraClient,
+    mqtt_client: MqttClient,
+    topics: Topics,
+    settings: Settings,
+    cache: FileCache,
+    discovery_store: DiscoveryStore,
+) -> None:
+    """Refresh cached camera details, republishing config if they changed"""
+
+    try:
+        if await camera.refresh_details(cache):
+            logger.info(f"Camera details changed for {camera.host}, republishing")
+            await publish_config(camera, mqtt_client, topics, settings, discovery_store)
     except AmcrestError as error:
-        logger.error(f"Amcrest error: {error}")
-        mqtt_client.exit_gracefully(topic=topics["status"], rc=1)
+        logger.warning(f"Error refreshing camera details {error}")
 
 
-async def refresh_storage_sensors(
+async def publish_config(
     camera: CameraClient,
     mqtt_client: MqttClient,
-    topics: Dict[str, Any],
-    polling_interval: int = 3600,
+    topics: Topics,
+    settings: Settings,
+    discovery_store: DiscoveryStore,
 ) -> None:
-    """Refresh storage sensors from Amcrest camera"""
+    """Publish Home Assistant discovery config, device config and online status
 
-    while True:
-        logger.info("Fetching storage sensors...")
-        try:
-            storage = camera.client.storage_all
+    Everything goes out as one batch, so this takes about one round trip to the
+    broker however many discovery messages changed.
+    """
 
-            mqtt_client.publish(
-                topic=topics["storage_used_percent"],
-                payload=str(storage["used_percent"]),
-            )
-            mqtt_client.publish(
-                topic=topics["storage_used"], payload=to_gb(float(storage["used"][0]))
-            )
-            mqtt_client.publish(
-                topic=topics["storage_total"], payload=to_gb(float(storage["total"][0]))
+    # Configure Home Assistant
+    discovery = {}
+    if settings.home_assistant:
+        discovery = pending_discovery(camera, topics, settings, discovery_store)
+        if discovery:
+            logger.info(
+                f"Writing {len(discovery)} Home Assistant discovery config messages..."
             )
-        except AmcrestError as error:
-            logger.warning(f"Error fetching storage information {error}")
+        else:
+            logger.info("Home Assistant discovery config is up to date")
+
+    messages = discovery_messages(discovery) + [
+        MqttMessage(
+            topic=topics.config,
+            payload={
+                "version": camera.version,
+                "device_type": camera.device_type,
+                "device_name": camera.name,
+                "sw_version": camera.amcrest_version,
+                "serial_number": camera.serial_number,
+                "host": camera.host,
+                # How to decode the event topic, as MQTT 3.1.1 can't say per message
+                "event_content_type": get_encoding(
+                    settings.event_encoding
+                ).content_type,
+            },
+            as_json=True,
+        ),
+        MqttMessage(topic=topics.status, payload=ONLINE),
+    ]
+    errors = await mqtt_client.publish_many(messages)
+
+    if discovery:
+        record_discovery(discovery_store, discovery, errors[: len(discovery)])
+    for message, error in zip(messages[len(discovery) :], errors[len(discovery) :]):
+        if error is not None:
+            logger.warning(f"Error publishing to {message.topic}: {error}")
 
-        await asyncio.sleep(polling_interval)
+
+async def poll_device(
+    camera: CameraClient,
+    mqtt_client: MqttClient,
+    topics: Topics,
+    settings: Settings,
+    metrics: Optional[Metrics] = None,
+    events: Optional[AsyncIterator[Event]] = None,
+    snapshots: Optional[SnapshotFetcher] = None,
+    started: Optional[float] = None,
+) -> None:
+    """Route events from the camera, or `events` if given, to MQTT
+
+    With snapshots enabled, trigger sensors turning on fetch one with `snapshots`.
+    The time to the first event is logged, measured from `started` if given.
+    """
+
+    router = EventRouter.for_camera(camera, topics)
+    tracker = StateTracker(
+        publish=lambda topic, state, trace=None: mqtt_client.publish(
+            topic=topic, payload=state, trace=trace
+        ),
+        off_delays={
+            topics[sensor]: delay for sensor, delay in settings.off_delays.items()
+        },
+    )
+
+    # Fetch a snapshot as soon as a trigger sensor turns on, so it is published
+    # shortly after the event rather than when Home Assistant asks for one
+    snapshot_topics = frozenset()
+    if settings.snapshots and snapshots is not None:
+        snapshot_topics = frozenset(
+            topics[sensor] for sensor in settings.snapshot_triggers
+        )
+
+    # Only subscribe to the configured codes, plus any the sensors rely on, so the
+    # camera never sends events we would discard
+    codes = "All"
+    if settings.event_codes is not None:
+        codes = ",".join(sorted(set(settings.event_codes) | set(router.codes)))
+    forward_codes = (
+        None
+        if settings.event_forward_codes is None
+        else frozenset(settings.event_forward_codes)
+    )
+
+    # Consumers usually read a few fields of each event, so only those are encoded.
+    # JSON is the default, only binary encodings are announced on every event.
+    projection = get_projection(settings.event_fields)
+    encoding = get_encoding(settings.event_encoding, settings.json_serializer)
+    content_type = None if encoding.name == "json" else encoding.content_type
+
+    # Only time events when someone is going to look at the timings
+    tracing = metrics is not None or settings.event_trace
+
+    if events is None:
+        logger.debug(f"Subscribing to event codes: {codes}")
+        if settings.event_watchdog_interval > 0:
+            events = EventWatchdog(
+                camera,
+                lambda: camera.client.async_event_actions(codes),
+                interval=settings.event_watchdog_interval,
+                timeout=settings.event_watchdog_timeout,
+                resubscribe_after=settings.event_resubscribe_after,
+                metrics=metrics,
+            ).events()
+        else:
+            events = camera.client.async_event_actions(codes)
+
+    if settings.event_record_dir:
+        events = record_events(
+            events, EventRecorder.for_camera(settings.event_record_dir, camera)
+        )
+
+    try:
+        async for code, payload in events:
+            # Timed from here, so time held back by the broker counts against it
+            trace = EventTrace() if tracing else None
+            if started is not None:
+                elapsed = time.monotonic() - started
+                logger.info(f"First event from {camera.host} after {elapsed:.2f}s")
+                if metrics is not None:
+                    metrics.startup.observe(elapsed, "first_event")
+                started = None
+
+            # Stop reading events while the broker is behind on acks
+            await mqtt_client.drain()
+
+            if metrics is not None:
+                metrics.events_received.inc(camera.host, code)
+
+            for topic, state in router.route(code, payload):
+                if state == ON and topic in snapshot_topics:
+                    snapshots.trigger()
+                tracker.update(topic, state, trace)
+
+            if trace is not None:
+                route_time = trace.mark_routed()
+                if metrics is not None:
+                    metrics.event_latency.observe(route_time, "route")
+
+            if forward_codes is None or code in forward_codes:
+                event = payload if projection is None else projection(payload)
+                if settings.event_trace:
+                    event = event | {"trace": trace.as_fields()}
+                mqtt_client.publish(
+                    topic=topics.event,
+                    payload=event,
+                    as_json=True,
+                    spool=True,
+                    trace=trace,
+                    serializer=encoding.serializer,
+                    content_type=content_type,
+                )
+            logger.debug(str(payload))
+    finally:
+        tracker.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,444 @@
+"""Local stand-ins for an Amcrest camera and an MQTT broker, for tests and benchmarks"""
+
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from paho.mqtt.client import topic_matches_sub
+
+BOUNDARY = "myboundary"
+
+MAGIC_BOX = {
+    "getSerialNo": "sn=BENCH0001",
+    "getSoftwareVersion": "version=2.420.0000000.3.R,build:2023-01-01",
+    "getMachineName": "name=Bench Camera",
+    "getDeviceType": "type=AD410",
+}
+
+STORAGE = (
+    "list.info[0].Detail[0].Path=/mnt/sd\r\n"
+    "list.info[0].Detail[0].TotalBytes=31914983424.000000\r\n"
+    "list.info[0].Detail[0].UsedBytes=7978745856.000000\r\n"
+)
+
+
+class FakeCamera:
+    """Serves the camera endpoints the bridge uses, streaming events when attached
+
+    Every connection to eventManager.cgi streams `events` VideoMotion events at
+    `rate` per second (as fast as possible if 0), then stays open. Each event carries
+    its index in `data`, and the monotonic time it was written is kept in `sent`.
+    """
+
+    def __init__(self, events: int = 1000, rate: float = 0) -> None:
+        self.events = events
+        self.rate = rate
+        self.sent: Dict[int, float] = {}
+        self._stopped = threading.Event()
+
+        camera = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                action = query.get("action", [""])[0]
+
+                if url.path == "/cgi-bin/eventManager.cgi" and action == "attach":
+                    camera._stream(self)
+                elif url.path == "/cgi-bin/magicBox.cgi" and action in MAGIC_BOX:
+                    self._reply(MAGIC_BOX[action])
+                elif url.path == "/cgi-bin/storageDevice.cgi":
+                    self._reply(STORAGE)
+                else:
+                    self.send_error(404)
+
+            def _reply(self, body: str) -> None:
+                content = f"{body}\r\n".encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _stream(self, handler: BaseHTTPRequestHandler) -> None:
+        handler.send_response(200)
+        handler.send_header(
+            "Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+        )
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        interval = 1 / self.rate if self.rate else 0
+        started = time.monotonic()
+        try:
+            for index in range(self.events):
+                if interval:
+                    delay = started + index * interval - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                action = "Start" if index % 2 == 0 else "Stop"
+                data = json.dumps({"Index": index})
+                body = f"Code=VideoMotion;action={action};index=0;data={data}"
+                part = (
+                    f"--{BOUNDARY}\r\n"
+                    "Content-Type: text/plain\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n"
+                    f"{body}\r\n"
+                )
+                self.sent[index] = time.monotonic()
+                handler.wfile.write(part.encode())
+                handler.wfile.flush()
+
+            # A real camera keeps the stream open, sending a heartbeat now and then
+            while not self._stopped.wait(1):
+                handler.wfile.write(b"\r\n")
+                handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@dataclass
+class Message:
+    received: float
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+    # MQTT v5 properties by name, e.g. content_type, expiry or user_properties
+    properties: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class _Session:
+    version: int = 4
+    filters: List[str] = field(default_factory=list)
+    aliases: Dict[int, str] = field(default_factory=dict)
+
+
+def _remaining_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _packet(packet_type: int, body: bytes = b"", flags: int = 0) -> bytes:
+    return bytes([packet_type << 4 | flags]) + _remaining_length(len(body)) + body
+
+
+def _string(value: str) -> bytes:
+    encoded = value.encode()
+    return struct.pack("!H", len(encoded)) + encoded
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value, multiplier = 0, 1
+    while True:
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return value, offset
+
+
+def _read_string(data: bytes, offset: int) -> Tuple[str, int]:
+    (length,) = struct.unpack("!H", data[offset : offset + 2])
+    return data[offset + 2 : offset + 2 + length].decode(), offset + 2 + length
+
+
+def _read_properties(data: bytes, offset: int) -> Tuple[Dict[str, Any], int]:
+    """Parse the PUBLISH properties of MQTT v5 which the bridge may send"""
+    length, offset = _read_varint(data, offset)
+    end = offset + length
+    properties: Dict[str, Any] = {}
+    while offset < end:
+        identifier = data[offset]
+        offset += 1
+        if identifier == 0x01:
+            properties["payload_format"], offset = data[offset], offset + 1
+        elif identifier == 0x02:
+            (properties["expiry"],) = struct.unpack("!I", data[offset : offset + 4])
+            offset += 4
+        elif identifier == 0x03:
+            properties["content_type"], offset = _read_string(data, offset)
+        elif identifier == 0x08:
+            properties["response_topic"], offset = _read_string(data, offset)
+        elif identifier == 0x09:
+            (length,) = struct.unpack("!H", data[offset : offset + 2])
+            properties["correlation_data"] = data[offset + 2 : offset + 2 + length]
+            offset += 2 + length
+        elif identifier == 0x23:
+            (properties["topic_alias"],) = struct.unpack(
+                "!H", data[offset : offset + 2]
+            )
+            offset += 2
+        elif identifier == 0x26:
+            name, offset = _read_string(data, offset)
+            value, offset = _read_string(data, offset)
+            properties.setdefault("user_properties", []).append((name, value))
+        else:
+            raise ValueError(f"Unexpected PUBLISH property {identifier:#x}")
+    return properties, end
+
+
+def _forwarded_properties(properties: Dict[str, Any]) -> bytes:
+    """Encode the PUBLISH properties passed on to MQTT v5 subscribers"""
+    data = b""
+    if "content_type" in properties:
+        data += b"\x03" + _string(properties["content_type"])
+    if "response_topic" in properties:
+        data += b"\x08" + _string(properties["response_topic"])
+    if "correlation_data" in properties:
+        correlation_data = properties["correlation_data"]
+        data += b"\x09" + struct.pack("!H", len(correlation_data)) + correlation_data
+    for name, value in properties.get("user_properties", []):
+        data += b"\x26" + _string(name) + _string(value)
+    return _remaining_length(len(data)) + data
+
+
+class FakeBroker:
+    """An in-process MQTT 3.1.1 and 5 broker, good enough for one or two local clients
+
+    Every PUBLISH is recorded in `messages` with its arrival time, and counted per
+    topic in `counts`. `publish_bytes` adds up the size of the PUBLISH packets
+    received. MQTT v5 clients may use up to `topic_alias_maximum` topic aliases.
+    Acks are sent `ack_delay` seconds late, to stand in for a remote broker.
+    Subscriptions are honoured at QoS 0, without retained messages. MQTT v5
+    subscribers are passed the content type, response topic, correlation data and
+    user properties of a message.
+    """
+
+    def __init__(self, topic_alias_maximum: int = 10, ack_delay: float = 0) -> None:
+        self.messages: List[Message] = []
+        self.counts: Counter = Counter()
+        self.publish_bytes = 0
+        self.topic_alias_maximum = topic_alias_maximum
+        self.ack_delay = ack_delay
+        self._condition = threading.Condition()
+        self._subscribers: Dict[socket.socket, _Session] = {}
+        self._lock = threading.Lock()
+
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                broker._handle(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def wait_for(self, predicate: Callable[[], bool], timeout: float = 30) -> bool:
+        """Wait until predicate() is true, returns False on timeout
+
+        The predicate is checked on every message, so it should be cheap.
+        """
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout=timeout)
+
+    def topic(self, topic: str) -> List[Message]:
+        with self._condition:
+            return [message for message in self.messages if message.topic == topic]
+
+    def clear(self) -> None:
+        with self._condition:
+            self.messages.clear()
+            self.counts.clear()
+            self.publish_bytes = 0
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handle(self, connection: socket.socket) -> None:
+        stream = connection.makefile("rb")
+        session = _Session()
+        try:
+            while True:
+                header = stream.read(1)
+                if not header:
+                    return
+
+                length, multiplier = 0, 1
+                while True:
+                    byte = stream.read(1)[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+
+                if not self._dispatch(
+                    connection,
+                    session,
+                    header[0] >> 4,
+                    header[0] & 0x0F,
+                    stream.read(length),
+                ):
+                    return
+        except (ConnectionError, IndexError, OSError):
+            return
+        finally:
+            with self._lock:
+                self._subscribers.pop(connection, None)
+            connection.close()
+
+    def _dispatch(
+        self,
+        connection: socket.socket,
+        session: _Session,
+        packet_type: int,
+        flags: int,
+        body: bytes,
+    ) -> bool:
+        if packet_type == 1:  # CONNECT
+            self._connect(connection, session, body)
+        elif packet_type == 3:  # PUBLISH
+            self._publish(connection, session, flags, body)
+        elif packet_type == 6:  # PUBREL
+            connection.sendall(_packet(7, body[:2]))
+        elif packet_type == 8:  # SUBSCRIBE
+            self._subscribe(connection, session, body)
+        elif packet_type == 10:  # UNSUBSCRIBE
+            self._unsubscribe(connection, session, body)
+        elif packet_type == 12:  # PINGREQ
+            connection.sendall(_packet(13))
+        elif packet_type == 14:  # DISCONNECT
+            return False
+        return True
+
+    def _connect(
+        self, connection: socket.socket, session: _Session, body: bytes
+    ) -> None:
+        # Protocol name, then the protocol level: 4 for 3.1.1, 5 for 5
+        _, offset = _read_string(body, 0)
+        session.version = body[offset]
+
+        if session.version < 5:
+            connection.sendall(_packet(2, b"\x00\x00"))
+            return
+
+        properties = b"\x22" + struct.pack("!H", self.topic_alias_maximum)
+        connection.sendall(
+            _packet(2, b"\x00\x00" + _remaining_length(len(properties)) + properties)
+        )
+
+    def _publish(
+        self, connection: socket.socket, session: _Session, flags: int, body: bytes
+    ) -> None:
+        received = time.monotonic()
+        qos = (flags >> 1) & 0x03
+        topic, offset = _read_string(body, 0)
+        packet_id: Optional[bytes] = None
+        if qos:
+            packet_id, offset = body[offset : offset + 2], offset + 2
+
+        properties: Dict[str, Any] = {}
+        if session.version >= 5:
+            properties, offset = _read_properties(body, offset)
+            alias = properties.get("topic_alias")
+            if alias is not None:
+                if topic:
+                    session.aliases[alias] = topic
+                else:
+                    topic = session.aliases[alias]
+        payload = body[offset:]
+
+        if qos:
+            ack = _packet(4 if qos == 1 else 5, packet_id)
+            if self.ack_delay:
+                threading.Timer(self.ack_delay, connection.sendall, (ack,)).start()
+            else:
+                connection.sendall(ack)
+
+        with self._condition:
+            self.messages.append(
+                Message(received, topic, payload, qos, bool(flags & 1), properties)
+            )
+            self.counts[topic] += 1
+            self.publish_bytes += 1 + len(_remaining_length(len(body))) + len(body)
+            self._condition.notify_all()
+
+        with self._lock:
+            subscribers = [
+                (subscriber, subscription.version)
+                for subscriber, subscription in self._subscribers.items()
+                if any(topic_matches_sub(sub, topic) for sub in subscription.filters)
+            ]
+        forwarded = _forwarded_properties(properties)
+        for subscriber, version in subscribers:
+            subscriber.sendall(
+                _packet(
+                    3, _string(topic) + (forwarded if version >= 5 else b"") + payload
+                )
+            )
+
+    def _subscribe(
+        self, connection: socket.socket, session: _Session, body: bytes
+    ) -> None:
+        packet_id, offset = body[:2], 2
+        if session.version >= 5:
+            length, offset = _read_varint(body, offset)
+            offset += length
+
+        granted = bytearray()
+        while offset < len(body):
+            topic_filter, offset = _read_string(body, offset)
+            session.filters.append(topic_filter)
+            # Skip the subscription options
+            offset += 1
+            granted.append(0)
+
+        with self._lock:
+            self._subscribers[connection] = session
+        properties = b"\x00" if session.version >= 5 else b""
+        connection.sendall(_packet(9, packet_id + properties + bytes(granted)))
+
+    def _unsubscribe(
+        self, connection: socket.socket, session: _Session, body: bytes
+    ) -> None:
+        packet_id, offset = body[:2], 2
+        if session.version >= 5:
+            length, offset = _read_varint(body, offset)
+            offset += length
+
+        removed = 0
+        with self._lock:
+            while offset < len(body):
+                topic_filter, offset = _read_string(body, offset)
+                if topic_filter in session.filters:
+                    session.filters.remove(topic_filter)
+                removed += 1
+
+        # MQTT v5 acks each filter with a reason code, success being 0
+        acks = b"\x00" + bytes(removed) if session.version >= 5 else b""
+        connection.sendall(_packet(11, packet_id + acks))
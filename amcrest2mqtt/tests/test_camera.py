@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+from amcrest import AmcrestError
+
+from amcrest2mqtt.cache import FileCache
+from amcrest2mqtt.camera import CameraClient
+
+
+def test_run_returns_result():
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    assert asyncio.run(camera.run(lambda: 5)) == 5
+
+
+def test_run_timeout():
+    camera = CameraClient("127.0.0.1", "80", "admin", "password", timeout=0.1)
+    with pytest.raises(AmcrestError):
+        asyncio.run(camera.run(time.sleep, 1))
+
+
+def test_run_timeout_includes_waiting_for_a_worker():
+    camera = CameraClient(
+        "127.0.0.1", "80", "admin", "password", timeout=5, max_workers=1
+    )
+
+    async def run() -> None:
+        hung = asyncio.ensure_future(camera.run(time.sleep, 0.5))
+        await asyncio.sleep(0)
+
+        started = time.monotonic()
+        with pytest.raises(AmcrestError):
+            await camera.run(lambda: None, timeout=0.1, name="probe")
+        assert time.monotonic() - started < 0.4
+        await hung
+
+    asyncio.run(run())
+
+
+def test_timed_out_call_keeps_its_worker():
+    limit = asyncio.Semaphore(1)
+    camera = CameraClient(
+        "127.0.0.1", "80", "admin", "password", timeout=0.1, limit=limit
+    )
+
+    async def run() -> None:
+        with pytest.raises(AmcrestError):
+            await camera.run(time.sleep, 0.3)
+        # Still running on the camera, so a client for the same camera waits
+        assert limit.locked()
+        restarted = CameraClient(
+            "127.0.0.1", "80", "admin", "password", timeout=1, limit=limit
+        )
+        assert await restarted.run(lambda: 5) == 5
+        assert not limit.locked()
+
+    asyncio.run(run())
+
+
+def test_probe_does_not_wait_for_a_worker():
+    limit = asyncio.Semaphore(1)
+    camera = CameraClient(
+        "127.0.0.1", "80", "admin", "password", timeout=5, limit=limit
+    )
+    camera.client = FakeAmcrest()
+
+    async def run() -> None:
+        busy = asyncio.ensure_future(camera.run(time.sleep, 0.5))
+        await asyncio.sleep(0.05)
+        assert limit.locked()
+
+        started = time.monotonic()
+        await camera.probe(0.1)
+        assert time.monotonic() - started < 0.4
+        await busy
+
+    asyncio.run(run())
+
+
+class FakeAmcrest:
+    serial_number = "SERIAL"
+    software_information = ("version=1.0", "2023-01-01")
+    machine_name = "name=Front Door"
+    device_type = "type=AD410"
+
+    async def async_command(self, cmd: str, retries=None, timeout_cmd=None) -> str:
+        return "result=2024-01-01 00:00:00"
+
+
+def test_load_details_uses_cache(tmp_path):
+    cache = FileCache(str(tmp_path))
+
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.client = FakeAmcrest()
+    assert not asyncio.run(camera.load_details(cache))
+    assert camera.amcrest_version == "1.0 (2023-01-01)"
+    assert camera.device_slug == "front_door"
+    assert camera.is_doorbell
+
+    restarted = CameraClient("127.0.0.1", "80", "admin", "password")
+    assert asyncio.run(restarted.load_details(cache))
+    assert restarted.details == camera.details
+
+
+def test_load_details_ignores_invalid_cache(tmp_path):
+    cache = FileCache(str(tmp_path))
+    # Written by a version with other fields
+    cache.save("details_127.0.0.1", {"serial_number": "OLD", "model": "AD410"})
+
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.client = FakeAmcrest()
+    assert not asyncio.run(camera.load_details(cache))
+    assert camera.serial_number == "SERIAL"
+    assert cache.load("details_127.0.0.1")["serial_number"] == "SERIAL"
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List
+
+from paho.mqtt.client import MQTTMessage
+
+from amcrest2mqtt.camera import CameraClient, CameraDetails
+from amcrest2mqtt.commands import CommandDevice, CommandDispatcher, CommandSpec
+from amcrest2mqtt.snapshot import SnapshotFetcher
+from amcrest2mqtt.topics import Topics
+
+
+class FakeMqttClient:
+    def __init__(self) -> None:
+        self.handlers: Dict[str, Callable[[MQTTMessage], None]] = {}
+        self.published: List[Dict[str, Any]] = []
+
+    def subscribe(self, topic: str, handler: Callable[[MQTTMessage], None]) -> None:
+        self.handlers[topic] = handler
+
+    def unsubscribe(self, topic: str) -> None:
+        del self.handlers[topic]
+
+    def publish(self, topic: str, payload: Any, **kwargs: Any) -> None:
+        self.published.append({"topic": topic, "payload": payload} | kwargs)
+
+
+def make_camera() -> CameraClient:
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.details = CameraDetails("SERIAL", "1.0", "1", "Front door", "AD410")
+    return camera
+
+
+def message(topic: str, payload: bytes, retain: bool = False) -> MQTTMessage:
+    result = MQTTMessage(topic=topic.encode())
+    result.payload = payload
+    result.retain = retain
+    return result
+
+
+def send(
+    mqtt_client: FakeMqttClient, name: str, payload: bytes = b"", retain: bool = False
+) -> None:
+    handler = mqtt_client.handlers["amcrest2mqtt/SERIAL/command/+"]
+    handler(message(f"amcrest2mqtt/SERIAL/command/{name}", payload, retain))
+
+
+def responses(mqtt_client: FakeMqttClient) -> List[Dict[str, Any]]:
+    return [
+        message["payload"]
+        for message in mqtt_client.published
+        if message["topic"].startswith("amcrest2mqtt/SERIAL/response/")
+    ]
+
+
+def test_repeated_commands_are_merged():
+    release = threading.Event()
+    calls = []
+
+    def privacy(device: CommandDevice, payload: str) -> str:
+        calls.append(payload)
+        release.wait(1)
+        return "OK"
+
+    camera = make_camera()
+    topics = Topics.for_camera(camera, "homeassistant")
+    mqtt_client = FakeMqttClient()
+
+    async def run() -> None:
+        commands = CommandDispatcher(
+            mqtt_client, commands={"privacy": CommandSpec("privacy", privacy)}
+        )
+        commands.add_device(camera, topics)
+        task = asyncio.ensure_future(commands.run())
+
+        for payload in (b"on", b"on", b"off", b"on"):
+            send(mqtt_client, "privacy", payload)
+        await asyncio.sleep(0.05)
+        release.set()
+        while len(responses(mqtt_client)) < 2:
+            await asyncio.sleep(0.01)
+
+        # A repeat once the command finished runs it again
+        send(mqtt_client, "privacy", b"on")
+        while len(responses(mqtt_client)) < 3:
+            await asyncio.sleep(0.01)
+
+        commands.remove_device(topics)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert calls == ["on", "off", "on"]
+    assert (
+        responses(mqtt_client)
+        == [{"command": "privacy", "status": "ok", "result": "OK"}] * 3
+    )
+    assert mqtt_client.handlers == {}
+
+
+def test_full_queue_and_unknown_commands_are_rejected():
+    camera = make_camera()
+    topics = Topics.for_camera(camera, "homeassistant")
+    mqtt_client = FakeMqttClient()
+
+    async def run() -> None:
+        commands = CommandDispatcher(
+            mqtt_client,
+            queue_size=1,
+            commands={"reboot": CommandSpec("reboot", lambda camera, payload: "OK")},
+        )
+        commands.add_device(camera, topics)
+        # No workers are running, so the first command stays queued
+        send(mqtt_client, "reboot", b"now")
+        send(mqtt_client, "reboot", b"later")
+        send(mqtt_client, "explode")
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert responses(mqtt_client) == [
+        {"command": "reboot", "status": "error", "error": "Too many commands"},
+        {"command": "explode", "status": "error", "error": "Unknown command"},
+    ]
+    assert mqtt_client.published[1]["topic"] == "amcrest2mqtt/SERIAL/response/explode"
+
+
+def test_retained_commands_are_not_run():
+    calls = []
+    camera = make_camera()
+    topics = Topics.for_camera(camera, "homeassistant")
+    mqtt_client = FakeMqttClient()
+
+    async def run() -> None:
+        commands = CommandDispatcher(
+            mqtt_client,
+            commands={"reboot": CommandSpec("reboot", lambda *args: calls.append(1))},
+        )
+        commands.add_device(camera, topics)
+        task = asyncio.ensure_future(commands.run())
+        send(mqtt_client, "reboot", retain=True)
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    assert calls == []
+    assert responses(mqtt_client) == [
+        {
+            "command": "reboot",
+            "status": "error",
+            "error": "Retained commands are ignored",
+        }
+    ]
+
+
+class FakeAmcrest:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.release = threading.Event()
+
+    def snapshot(self, stream: bool = True) -> bytes:
+        self.calls += 1
+        self.release.wait(1)
+        return b"\xff\xd8jpeg"
+
+
+def test_snapshot_command_shares_the_fetch_in_flight():
+    camera = make_camera()
+    camera.client = FakeAmcrest()
+    topics = Topics.for_camera(camera, "homeassistant")
+    mqtt_client = FakeMqttClient()
+
+    async def run() -> None:
+        snapshots = SnapshotFetcher(
+            camera,
+            lambda image: mqtt_client.publish(
+                topic=topics.snapshot, payload=image, content_type="image/jpeg"
+            ),
+        )
+        commands = CommandDispatcher(mqtt_client)
+        commands.add_device(camera, topics, snapshots)
+        task = asyncio.ensure_future(commands.run())
+
+        # Triggered by an event, then requested while it is being fetched
+        snapshots.trigger()
+        send(mqtt_client, "snapshot")
+        await asyncio.sleep(0.05)
+        camera.client.release.set()
+        while not responses(mqtt_client):
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert camera.client.calls == 1
+    image, response = mqtt_client.published
+    assert image["topic"] == topics.snapshot
+    assert image["payload"] == b"\xff\xd8jpeg"
+    assert image["content_type"] == "image/jpeg"
+    assert response["payload"] == {"command": "snapshot", "status": "ok"}
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from amcrest2mqtt.config import Settings, load_devices
+
+
+def test_load_devices_from_env(monkeypatch):
+    monkeypatch.delenv("AMCREST_DEVICES_FILE", raising=False)
+    monkeypatch.setenv("AMCREST_HOST", "192.168.0.10")
+    monkeypatch.setenv("AMCREST_PASSWORD", "password")
+
+    devices = load_devices()
+    assert len(devices) == 1
+    assert devices[0].host == "192.168.0.10"
+    assert devices[0].port == "80"
+    assert devices[0].username == "admin"
+
+
+def test_load_devices_from_file(monkeypatch, tmp_path):
+    devices_file = tmp_path / "devices.json"
+    devices_file.write_text(
+        json.dumps(
+            [{"host": "192.168.0.10"}, {"host": "192.168.0.11", "password": "other"}]
+        )
+    )
+    monkeypatch.setenv("AMCREST_DEVICES_FILE", str(devices_file))
+    monkeypatch.setenv("AMCREST_PASSWORD", "password")
+
+    devices = load_devices()
+    assert [device.host for device in devices] == ["192.168.0.10", "192.168.0.11"]
+    assert [device.password for device in devices] == ["password", "other"]
+
+
+def test_event_codes(monkeypatch):
+    monkeypatch.setenv("EVENT_CODES", "VideoMotion, _DoTalkAction_")
+    monkeypatch.setenv("EVENT_FORWARD_CODES", "All")
+
+    settings = Settings.from_env()
+    assert settings.event_codes == ["VideoMotion", "_DoTalkAction_"]
+    assert settings.event_forward_codes is None
+
+
+def test_unknown_snapshot_trigger_fails(monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_TRIGGERS", "doorbell, person")
+
+    with pytest.raises(SystemExit):
+        Settings.from_env()
+
+    monkeypatch.setenv("SNAPSHOT_TRIGGERS", "doorbell, motion")
+    assert Settings.from_env().snapshot_triggers == ["doorbell", "motion"]
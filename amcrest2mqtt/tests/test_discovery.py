@@ -0,0 +1,76 @@
+import asyncio
+from concurrent.futures import Future
+from typing import Any, List
+
+from amcrest2mqtt.cache import FileCache
+from amcrest2mqtt.camera import CameraClient, CameraDetails
+from amcrest2mqtt.config import Settings
+from amcrest2mqtt.discovery import DiscoveryStore, build_discovery
+from amcrest2mqtt.main import publish_config
+from amcrest2mqtt.topics import Topics
+
+
+class FakeMqttClient:
+    def __init__(self) -> None:
+        self.published: List[tuple] = []
+
+    def publish(self, topic: str, payload: Any, **kwargs: Any) -> Future:
+        self.published.append((topic, payload))
+        future: Future = Future()
+        future.set_result(len(self.published))
+        return future
+
+    async def publish_many(self, messages: List[Any], **kwargs: Any) -> List[None]:
+        for message in messages:
+            self.publish(message.topic, message.payload)
+        return [None] * len(messages)
+
+
+def make_camera() -> CameraClient:
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.details = CameraDetails(
+        serial_number="SERIAL",
+        version="1.0",
+        build_version="2023-01-01",
+        name="Front Door",
+        device_type="AD410",
+    )
+    return camera
+
+
+def test_publish_config_only_publishes_discovery_changes(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME_ASSISTANT", "true")
+    monkeypatch.setenv("STORAGE_POLL_INTERVAL", "3600")
+    settings = Settings.from_env()
+    camera = make_camera()
+    topics = Topics.for_camera(camera, settings.home_assistant_prefix)
+
+    def run(settings: Settings) -> List[tuple]:
+        mqtt_client = FakeMqttClient()
+        store = DiscoveryStore(FileCache(str(tmp_path)), "discovery")
+        asyncio.run(publish_config(camera, mqtt_client, topics, settings, store))
+        # Device config and status are published every time
+        assert mqtt_client.published[-2][0] == topics.config
+        assert mqtt_client.published[-1][0] == topics.status
+        return mqtt_client.published[:-2]
+
+    # 10 entities, all but storage health with a legacy topic to clear
+    assert len(run(settings)) == 19
+    assert run(settings) == []
+
+    # Disabling storage polling clears the storage entities
+    monkeypatch.setenv("STORAGE_POLL_INTERVAL", "0")
+    published = run(Settings.from_env())
+    assert len(published) == 3
+    assert all(payload == "" for _, payload in published)
+
+
+def test_snapshot_camera_discovery(monkeypatch):
+    monkeypatch.setenv("SNAPSHOTS", "true")
+    settings = Settings.from_env()
+    camera = make_camera()
+    topics = Topics.for_camera(camera, settings.home_assistant_prefix)
+
+    config = build_discovery(camera, topics, settings)["snapshot"]
+    assert config["topic"] == topics.snapshot
+    assert topics.home_assistant["snapshot"].startswith("homeassistant/camera/")
@@ -0,0 +1,53 @@
+import pytest
+
+from amcrest2mqtt.encoding import (
+    JSON_SERIALIZERS,
+    get_encoding,
+    get_json_serializer,
+    get_projection,
+)
+
+
+def test_serializers_agree():
+    payload = {"Code": "VideoMotion", "action": "Start", "data": {"Id": [0]}}
+    for serializer in JSON_SERIALIZERS.values():
+        assert (
+            serializer(payload)
+            == b'{"Code":"VideoMotion","action":"Start","data":{"Id":[0]}}'
+        )
+
+
+def test_unknown_serializer_falls_back_to_json():
+    assert get_json_serializer("missing") is JSON_SERIALIZERS["json"]
+
+
+def test_projection():
+    payload = {
+        "Code": "VideoMotion",
+        "action": "Start",
+        "index": 0,
+        "data": {"Id": [0], "RegionName": ["Driveway"], "SmartMotionEnable": False},
+    }
+    project = get_projection(["Code", "action", "data.RegionName", "data.Missing"])
+    assert project(payload) == {
+        "Code": "VideoMotion",
+        "action": "Start",
+        "data": {"RegionName": ["Driveway"]},
+    }
+
+    # Selecting a whole field wins over selecting within it
+    assert get_projection(["data.Id", "data"])(payload) == {"data": payload["data"]}
+    assert get_projection(None) is None
+
+
+def test_unknown_encoding_falls_back_to_json():
+    encoding = get_encoding("missing", "json")
+    assert encoding.name == "json"
+    assert encoding.serializer({"Code": "Test"}) == b'{"Code":"Test"}'
+
+
+def test_msgpack_encoding():
+    msgpack = pytest.importorskip("msgpack")
+    encoding = get_encoding("msgpack")
+    assert encoding.content_type == "application/msgpack"
+    assert msgpack.unpackb(encoding.serializer({"Code": "Test"})) == {"Code": "Test"}
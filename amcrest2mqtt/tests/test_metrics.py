@@ -0,0 +1,62 @@
+import asyncio
+import time
+import urllib.request
+
+import pytest
+from amcrest import AmcrestError
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.metrics import Counter, Histogram, Metrics
+
+
+def test_counter_render():
+    counter = Counter("events_total", "Events", ["code"])
+    counter.inc("VideoMotion")
+    counter.inc("VideoMotion")
+    counter.inc('Say "hi"')
+
+    assert counter.render() == [
+        "# HELP events_total Events",
+        "# TYPE events_total counter",
+        'events_total{code="Say \\"hi\\""} 1',
+        'events_total{code="VideoMotion"} 2',
+    ]
+
+
+def test_histogram_render():
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_serve():
+    metrics = Metrics()
+    metrics.reconnects.inc("mqtt")
+    metrics.serve(0, "127.0.0.1")
+
+    port = metrics._server.server_address[1]
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert b'amcrest2mqtt_reconnects_total{target="mqtt"} 1' in response.read()
+
+
+def test_camera_call_metrics():
+    metrics = Metrics()
+    camera = CameraClient(
+        "127.0.0.1", "80", "admin", "password", timeout=0.1, metrics=metrics
+    )
+    asyncio.run(camera.run(lambda: 5, name="storage_all"))
+    with pytest.raises(AmcrestError):
+        asyncio.run(camera.run(time.sleep, 1))
+
+    assert metrics.camera_call_duration.count("127.0.0.1", "storage_all") == 1
+    assert metrics.camera_call_errors.value("127.0.0.1", "storage_all") == 0
+    assert metrics.camera_call_errors.value("127.0.0.1", "sleep") == 1
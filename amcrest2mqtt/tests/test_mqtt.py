@@ -0,0 +1,443 @@
+import asyncio
+import json
+import socket
+import time
+from typing import Any, List
+
+import pytest
+from paho.mqtt.client import (
+    MQTTMessage,
+    MQTT_ERR_NO_CONN,
+    MQTT_ERR_PAYLOAD_SIZE,
+    MQTT_ERR_SUCCESS,
+)
+
+from amcrest2mqtt import mqtt
+from amcrest2mqtt.metrics import Metrics
+from amcrest2mqtt.mqtt import MqttClient, MqttMessage, MqttPublishError
+from amcrest2mqtt.spool import Spool
+from amcrest2mqtt.tracing import EventTrace
+from tests.fakes import FakeBroker
+
+
+class FakeMessageInfo:
+    def __init__(self, mid: int, rc: int = MQTT_ERR_SUCCESS) -> None:
+        self.mid = mid
+        self.rc = rc
+
+
+class FakeClient:
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.published: List[tuple] = []
+        self.rc = MQTT_ERR_SUCCESS
+        self.ack_immediately = False
+
+    def username_pw_set(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def connect(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def loop_start(self) -> None:
+        pass
+
+    def disconnect(self) -> None:
+        pass
+
+    def reconnect_delay_set(self, *args: Any) -> None:
+        pass
+
+    def max_inflight_messages_set(self, inflight: int) -> None:
+        pass
+
+    def is_connected(self) -> bool:
+        return self.rc != MQTT_ERR_NO_CONN
+
+    def publish(
+        self, topic: str, payload: Any, qos: int, retain: bool, properties=None
+    ):
+        mid = len(self.published) + 1
+        self.published.append((topic, payload, qos, retain))
+        if self.ack_immediately:
+            self.on_publish(self, None, mid)
+        return FakeMessageInfo(mid, self.rc)
+
+
+@pytest.fixture
+def client(monkeypatch) -> MqttClient:
+    monkeypatch.setattr(mqtt, "Client", FakeClient)
+    return MqttClient(host="localhost", port=1883)
+
+
+def test_publish_resolves_on_ack(client: MqttClient):
+    future = client.publish("topic", "on")
+    assert not future.done()
+
+    client.on_mqtt_publish(client.client, None, 1)
+    assert future.result(0) == 1
+
+
+def test_publish_ack_before_tracking(client: MqttClient):
+    client.client.ack_immediately = True
+    assert client.publish("topic", "on").result(0) == 1
+
+
+def test_publish_policy(client: MqttClient):
+    client.publish("amcrest2mqtt/SN/motion", "on")
+    client.publish("amcrest2mqtt/SN/event", "{}", qos=1)
+    assert client.client.published == [
+        ("amcrest2mqtt/SN/motion", "on", 0, True),
+        ("amcrest2mqtt/SN/event", "{}", 1, False),
+    ]
+
+
+def test_publish_failure(client: MqttClient):
+    client.client.rc = MQTT_ERR_PAYLOAD_SIZE
+    future = client.publish("topic", "on", exit_on_error=False)
+    with pytest.raises(MqttPublishError):
+        future.result(0)
+
+
+def test_disconnect_fails_pending(client: MqttClient):
+    future = client.publish("topic", "on")
+    client.on_mqtt_disconnect(client.client, None, 7)
+    with pytest.raises(MqttPublishError):
+        future.result(0)
+
+
+def test_publish_buffers_while_disconnected(monkeypatch):
+    monkeypatch.setattr(mqtt, "Client", FakeClient)
+    client = MqttClient(host="localhost", port=1883, buffer_size=2)
+
+    client.on_mqtt_disconnect(client.client, None, 7)
+    dropped = client.publish("topic", "1")
+    futures = [client.publish("topic", "2"), client.publish("topic", "3")]
+    assert client.client.published == []
+    with pytest.raises(MqttPublishError):
+        dropped.result(0)
+
+    client.client.ack_immediately = True
+    client.on_mqtt_connect(client.client, None, {}, 0)
+    assert [payload for _, payload, _, _ in client.client.published] == ["2", "3"]
+    assert all(future.done() for future in futures)
+
+
+def test_publish_while_flushing_goes_after_buffer(client: MqttClient):
+    client.on_mqtt_disconnect(client.client, None, 7)
+    client.publish("motion", "on")
+    client.publish("human", "on")
+
+    # A publish from another thread while the buffer is being sent
+    publish = client.client.publish
+
+    def publish_live(topic, payload, **kwargs):
+        if topic == "motion" and payload == "on":
+            client.publish("motion", "off")
+        return publish(topic, payload, **kwargs)
+
+    client.client.publish = publish_live
+    client.on_mqtt_connect(client.client, None, {}, 0)
+    assert [message[:2] for message in client.client.published] == [
+        ("motion", "on"),
+        ("human", "on"),
+        ("motion", "off"),
+    ]
+
+
+def test_no_conn_is_buffered(client: MqttClient):
+    client.client.rc = MQTT_ERR_NO_CONN
+    future = client.publish("topic", "on")
+    client.on_mqtt_disconnect(client.client, None, 7)
+    assert not future.done()
+
+    client.client.rc = MQTT_ERR_SUCCESS
+    client.on_mqtt_connect(client.client, None, {}, 0)
+    assert len(client.client.published) == 2
+
+
+def test_publish_many(client: MqttClient):
+    async def run() -> list:
+        publishing = asyncio.ensure_future(
+            client.publish_many(
+                [MqttMessage("a", "1"), MqttMessage("b", "2"), MqttMessage("c", "3")],
+                timeout=0.1,
+            )
+        )
+        await asyncio.sleep(0)
+
+        # Every message is on the wire before any ack arrives
+        assert len(client.client.published) == 3
+        # Unacknowledged QoS 0 messages are lost on disconnect
+        client.on_mqtt_publish(client.client, None, 1)
+        client.on_mqtt_disconnect(client.client, None, 0)
+        return await publishing
+
+    errors = asyncio.run(run())
+    assert errors[0] is None
+    assert isinstance(errors[1], MqttPublishError)
+    assert isinstance(errors[2], MqttPublishError)
+
+
+def test_publish_many_reports_errors_without_exiting(client: MqttClient):
+    client.client.rc = MQTT_ERR_PAYLOAD_SIZE
+    errors = asyncio.run(client.publish_many([MqttMessage("a", "1")]))
+    assert isinstance(errors[0], MqttPublishError)
+
+
+def test_publish_many_timeout(client: MqttClient):
+    errors = asyncio.run(client.publish_many([MqttMessage("a", "1", qos=1)], 0.01))
+    assert isinstance(errors[0], TimeoutError)
+
+
+def test_publish_metrics(monkeypatch):
+    monkeypatch.setattr(mqtt, "Client", FakeClient)
+    metrics = Metrics()
+    client = MqttClient(host="localhost", port=1883, metrics=metrics)
+
+    client.publish("topic", "on")
+    assert b'amcrest2mqtt_mqtt_publish_queue{state="pending"} 1' in metrics.render()
+
+    client.on_mqtt_publish(client.client, None, 1)
+    assert metrics.publishes.value("topic") == 1
+    assert metrics.ack_latency.count() == 1
+
+
+def test_publish_trace(monkeypatch):
+    monkeypatch.setattr(mqtt, "Client", FakeClient)
+    metrics = Metrics()
+    client = MqttClient(host="localhost", port=1883, metrics=metrics)
+
+    trace = EventTrace()
+    client.publish("topic", {"Code": "VideoMotion"}, as_json=True, trace=trace)
+    client.on_mqtt_publish(client.client, None, 1)
+
+    for stage in ("serialize", "ack", "total"):
+        assert metrics.event_latency.count(stage) == 1
+
+
+def test_asyncio_transport():
+    broker = FakeBroker()
+
+    async def run() -> None:
+        client = MqttClient(host="127.0.0.1", port=broker.port, transport="asyncio")
+        assert client.client._thread is None
+
+        await asyncio.gather(
+            *(client.async_publish("topic", f"{index}", qos=1) for index in range(5))
+        )
+        await client.drain()
+        assert [message.payload for message in broker.messages] == [
+            b"0",
+            b"1",
+            b"2",
+            b"3",
+            b"4",
+        ]
+
+        client.publish("topic", "last")
+        assert client.flush(timeout=2)
+
+    try:
+        asyncio.run(run())
+    finally:
+        broker.close()
+
+
+def test_asyncio_transport_reconnects_off_loop():
+    broker = FakeBroker()
+
+    async def run() -> None:
+        loop = asyncio.get_running_loop()
+        client = MqttClient(
+            host="127.0.0.1",
+            port=broker.port,
+            transport="asyncio",
+            reconnect_min_delay=0.01,
+            reconnect_max_delay=0.01,
+        )
+        await client.async_publish("topic", "before", qos=1)
+
+        # A broker slow to accept the connection
+        reconnect = client.client.reconnect
+
+        def slow_reconnect() -> Any:
+            time.sleep(0.5)
+            return reconnect()
+
+        client.client.reconnect = slow_reconnect
+        client.client.socket().shutdown(socket.SHUT_RDWR)
+        while client._connected:
+            await asyncio.sleep(0.01)
+
+        longest, last = 0.0, loop.time()
+        while not client._connected:
+            await asyncio.sleep(0.01)
+            longest, last = max(longest, loop.time() - last), loop.time()
+        assert longest < 0.3
+
+        await client.async_publish("topic", "after", qos=1)
+        assert broker.wait_for(
+            lambda: broker.messages and broker.messages[-1].payload == b"after", 2
+        )
+
+    try:
+        asyncio.run(run())
+    finally:
+        broker.close()
+
+
+def test_mqtt_v5_topic_aliases():
+    broker = FakeBroker()
+    topic = "amcrest2mqtt/SERIAL/event"
+
+    async def publish_events(protocol: str) -> int:
+        broker.clear()
+        client = MqttClient(
+            host="127.0.0.1", port=broker.port, transport="asyncio", protocol=protocol
+        )
+        while not client.client.is_connected():
+            await asyncio.sleep(0.01)
+
+        for index in range(20):
+            await client.async_publish(topic, {"Index": index}, as_json=True)
+        await client.async_publish(
+            "amcrest2mqtt/SERIAL/snapshot",
+            b"JPEG",
+            content_type="image/jpeg",
+            user_properties=[("camera", "front")],
+        )
+        # Everything has been written to the socket, so blocking the loop is fine
+        assert broker.wait_for(lambda: len(broker.messages) == 21, timeout=5)
+        client.client.disconnect()
+        return broker.publish_bytes
+
+    try:
+        v3_bytes = asyncio.run(publish_events("3.1.1"))
+        v5_bytes = asyncio.run(publish_events("5"))
+    finally:
+        broker.close()
+
+    # Every event reaches its topic, only the first carrying it in full
+    assert broker.counts[topic] == 20
+    events = broker.topic(topic)
+    assert [event.properties["topic_alias"] for event in events] == [1] * 20
+    assert events[0].properties["expiry"] == 300
+    assert v5_bytes < v3_bytes
+
+    snapshot = broker.topic("amcrest2mqtt/SERIAL/snapshot")[0]
+    assert snapshot.properties["content_type"] == "image/jpeg"
+    assert snapshot.properties["user_properties"] == [("camera", "front")]
+
+
+def test_spool_replay_keeps_mqtt_v5_properties(tmp_path):
+    broker = FakeBroker()
+    spool = Spool(str(tmp_path / "spool.db"))
+    spool.append(
+        "amcrest2mqtt/SERIAL/event",
+        b"\x81\xa4Code\xa5Doorbell",
+        content_type="application/msgpack",
+        user_properties=[("camera", "front")],
+    )
+    spool.flush()
+
+    async def run() -> None:
+        MqttClient(
+            host="127.0.0.1",
+            port=broker.port,
+            transport="asyncio",
+            protocol="5",
+            spool=spool,
+        )
+        while len(spool):
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(asyncio.wait_for(run(), 5))
+        assert broker.wait_for(lambda: broker.messages, timeout=2)
+    finally:
+        broker.close()
+
+    (event,) = broker.messages
+    assert event.properties["content_type"] == "application/msgpack"
+    assert event.properties["user_properties"] == [("camera", "front")]
+
+
+def test_subscribe_with_correlation_data():
+    broker = FakeBroker()
+    topic = "amcrest2mqtt/SERIAL/response/reboot"
+
+    async def run() -> List[MQTTMessage]:
+        client = MqttClient(
+            host="127.0.0.1", port=broker.port, transport="asyncio", protocol="5"
+        )
+        received: List[MQTTMessage] = []
+        client.subscribe("amcrest2mqtt/SERIAL/response/+", received.append)
+        while not client.client.is_connected():
+            await asyncio.sleep(0.01)
+        # Subscribed once connected, which the broker acks before anything else
+        await asyncio.sleep(0.05)
+
+        await client.async_publish(topic, {"status": "ok"}, as_json=True)
+        await client.async_publish(
+            topic, {"status": "ok"}, as_json=True, correlation_data=b"request-1"
+        )
+        for _ in range(500):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        client.unsubscribe("amcrest2mqtt/SERIAL/response/+")
+        client.client.disconnect()
+        return received
+
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        broker.close()
+
+    assert first.topic == second.topic == topic
+    assert json.loads(second.payload) == {"status": "ok"}
+    assert not hasattr(first.properties, "CorrelationData")
+    assert second.properties.CorrelationData == b"request-1"
+    # Responses aren't retained, unlike sensor states
+    assert not broker.topic(topic)[0].retain
+
+
+def test_spool_replay_keeps_undelivered_messages(monkeypatch, tmp_path):
+    monkeypatch.setattr(mqtt, "Client", FakeClient)
+    spool = Spool(str(tmp_path / "spool.db"))
+
+    async def wait_for_replay(client: MqttClient) -> None:
+        await asyncio.sleep(0)
+        while client._replaying():
+            await asyncio.sleep(0.01)
+
+    async def run() -> MqttClient:
+        client = MqttClient(host="localhost", port=1883, spool=spool)
+        client.on_mqtt_disconnect(client.client, None, 7)
+        for index in range(3):
+            client.publish("event", f"{index}", spool=True)
+
+        # The connection drops again before the replayed events are written out
+        client.on_mqtt_connect(client.client, None, {}, 0)
+        while len(client.client.published) < 3:
+            await asyncio.sleep(0.01)
+        client.on_mqtt_disconnect(client.client, None, 7)
+        await wait_for_replay(client)
+        assert len(spool) == 3
+
+        # Events published during the replay are spooled behind the older ones
+        client.client.ack_immediately = True
+        client.on_mqtt_connect(client.client, None, {}, 0)
+        await asyncio.sleep(0)
+        client.publish("event", "3", spool=True)
+        await wait_for_replay(client)
+        return client
+
+    client = asyncio.run(asyncio.wait_for(run(), 5))
+    assert [payload for _, payload, _, _ in client.client.published[3:]] == [
+        "0",
+        "1",
+        "2",
+        "3",
+    ]
+    assert len(spool) == 0
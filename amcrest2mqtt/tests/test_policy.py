@@ -0,0 +1,33 @@
+from amcrest2mqtt.policy import PublishPolicies, PublishPolicy, policies_from_env
+
+
+def test_classify():
+    policies = PublishPolicies(home_assistant_prefix="ha")
+    assert policies.classify("ha/binary_sensor/amcrest2mqtt-SN/motion/config") == (
+        "discovery"
+    )
+    assert policies.classify("amcrest2mqtt/SN/motion") == "state"
+    assert policies.classify("amcrest2mqtt/SN/snapshot") == "state"
+    assert policies.classify("amcrest2mqtt/SN/event") == "firehose"
+    assert policies.classify("amcrest2mqtt/SN/response/reboot") == "firehose"
+    assert policies.classify("amcrest2mqtt/SN/status") == "diagnostics"
+    assert policies.classify("amcrest2mqtt/SN/storage/used") == "diagnostics"
+
+
+def test_firehose_is_not_retained():
+    policies = PublishPolicies(policies_from_env(qos=1))
+    firehose = policies.for_topic("amcrest2mqtt/SN/event")
+    assert (firehose.qos, firehose.retain, firehose.expiry) == (0, False, 300)
+    state = policies.for_topic("amcrest2mqtt/SN/motion")
+    assert (state.qos, state.retain, state.expiry) == (1, True, None)
+
+
+def test_policies_from_env(monkeypatch):
+    monkeypatch.setenv("MQTT_STATE_QOS", "2")
+    monkeypatch.setenv("MQTT_DIAGNOSTICS_RETAIN", "false")
+    monkeypatch.setenv("MQTT_FIREHOSE_EXPIRY", "0")
+    policies = policies_from_env()
+    assert policies["state"] == PublishPolicy(qos=2, retain=True, alias=True)
+    assert policies["diagnostics"] == PublishPolicy(qos=0, retain=False)
+    assert policies["discovery"] == PublishPolicy(qos=0, retain=True)
+    assert policies["firehose"].expiry is None
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from amcrest2mqtt.camera import CameraClient, CameraDetails
+from amcrest2mqtt.recording import (
+    EventRecorder,
+    read_header,
+    record_events,
+    replay_events,
+)
+
+DETAILS = CameraDetails("SERIAL", "1.0", "2023-01-01", "Front Door", "AD410")
+
+EVENTS = [
+    ("VideoMotion", {"Code": "VideoMotion", "action": "Start", "index": "0"}),
+    ("VideoMotion", {"Code": "VideoMotion", "action": "Stop", "index": "0"}),
+]
+
+
+async def live_events():
+    for event in EVENTS:
+        await asyncio.sleep(0.1)
+        yield event
+
+
+async def collect(events):
+    return [event async for event in events]
+
+
+def record(path: str) -> None:
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.details = DETAILS
+    recorder = EventRecorder(path, camera)
+
+    assert asyncio.run(collect(record_events(live_events(), recorder))) == EVENTS
+    recorder.wait_closed()
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / "recording.jsonl.gz")
+    record(path)
+
+    header = read_header(path)
+    assert header["host"] == "127.0.0.1"
+    assert header["details"] == DETAILS
+
+    assert asyncio.run(collect(replay_events(path, speed=0))) == EVENTS
+
+
+def test_replay_speed(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    record(path)
+
+    started = time.monotonic()
+    asyncio.run(collect(replay_events(path, speed=10)))
+    assert 0.02 <= time.monotonic() - started < 0.1
+
+
+def test_close_writes_queued_events(tmp_path):
+    path = str(tmp_path / "recording.jsonl")
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.details = DETAILS
+    recorder = EventRecorder(path, camera, flush_interval=10)
+
+    for code, payload in EVENTS:
+        recorder.write(code, payload)
+    recorder.close()
+    # Closing cuts the wait for more events short
+    recorder.wait_closed(timeout=1)
+
+    assert asyncio.run(collect(replay_events(path, speed=0))) == EVENTS
@@ -0,0 +1,48 @@
+from amcrest2mqtt.camera import CameraClient, CameraDetails
+from amcrest2mqtt.router import EventHandlerSpec, EventRouter
+from amcrest2mqtt.topics import OFF, ON
+
+TOPICS = {"motion": "motion", "human": "human", "doorbell": "doorbell"}
+
+
+def make_camera(device_type: str) -> CameraClient:
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.details = CameraDetails("SERIAL", "1.0", "2023-01-01", "Door", device_type)
+    return camera
+
+
+def test_route_motion_by_model():
+    ad110 = EventRouter.for_camera(make_camera("AD110"), TOPICS)
+    ad410 = EventRouter.for_camera(make_camera("AD410"), TOPICS)
+
+    video_motion = {"action": "Start"}
+    assert list(ad110.route("VideoMotion", video_motion)) == []
+    assert list(ad410.route("VideoMotion", video_motion)) == [("motion", ON)]
+    assert list(ad110.route("ProfileAlarmTransmit", {"action": "Stop"})) == [
+        ("motion", OFF)
+    ]
+
+
+def test_route_human_and_doorbell():
+    router = EventRouter.for_camera(make_camera("AD410"), TOPICS)
+
+    vehicle = {"action": "Start", "data": {"ObjectType": "Vehicle"}}
+    human = {"action": "Start", "data": {"ObjectType": "Human"}}
+    assert list(router.route("CrossRegionDetection", vehicle)) == []
+    assert list(router.route("CrossRegionDetection", human)) == [("human", ON)]
+    assert list(router.route("_DoTalkAction_", {"data": {"Action": "Invite"}})) == [
+        ("doorbell", ON)
+    ]
+    assert list(router.route("NewFile", {})) == []
+
+
+def test_custom_handler():
+    spec = EventHandlerSpec(
+        code="AudioMutation",
+        topic="motion",
+        handler=lambda payload: ON,
+        supported=lambda camera: True,
+    )
+    router = EventRouter.for_camera(make_camera("IP8M"), TOPICS, handlers=[spec])
+    assert list(router.route("AudioMutation", {})) == [("motion", ON)]
+    assert list(router.route("VideoMotion", {"action": "Start"})) == []
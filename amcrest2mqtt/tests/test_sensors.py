@@ -0,0 +1,84 @@
+import asyncio
+from typing import Any, List
+
+from amcrest2mqtt.camera import CameraClient, CameraDetails
+from amcrest2mqtt.mqtt import MqttMessage, MqttPublishError
+from amcrest2mqtt.sensors import SENSORS, SensorScheduler, read_storage_health
+from amcrest2mqtt.topics import OFF, ON, Topics
+
+STORAGE_INFO = (
+    "list.info[0].Detail[0].IsError=false\r\n"
+    "list.info[0].Detail[0].TotalBytes=31914983424.000000\r\n"
+    "list.info[0].Detail[0].UsedBytes=7978745856.000000\r\n"
+    "list.info[0].State=Success\r\n"
+)
+
+
+class FakeAmcrest:
+    storage_device_info = STORAGE_INFO
+    storage_all = {
+        "used_percent": "25.0",
+        "used": ("7978745856.00", "B"),
+        "total": ("31914983424.00", "B"),
+    }
+
+
+def make_camera() -> CameraClient:
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.client = FakeAmcrest()
+    camera.details = CameraDetails("SERIAL", "1.0", "2023", "Front Door", "AD410")
+    return camera
+
+
+def test_scheduler_publishes_changes_only():
+    camera = make_camera()
+    topics = Topics.for_camera(camera, "homeassistant")
+    batches = []
+
+    async def publish_many(messages: List[MqttMessage]) -> List[Any]:
+        batches.append([(message.topic, message.payload) for message in messages])
+        # The first delivery of the total fails, so it is published again
+        return [
+            MqttPublishError(7) if len(batches) == 1 and index == 2 else None
+            for index in range(len(messages))
+        ]
+
+    scheduler = SensorScheduler(
+        camera,
+        topics,
+        publish_many=publish_many,
+        intervals={"storage": 3600, "storage_health": 0},
+    )
+    assert [spec.name for spec in scheduler.sensors] == ["storage"]
+
+    async def run() -> None:
+        for _ in range(3):
+            await scheduler.poll(scheduler.sensors[0])
+
+    asyncio.run(run())
+    assert batches == [
+        [
+            (topics.storage_used_percent, "25.0"),
+            (topics.storage_used, "7.43"),
+            (topics.storage_total, "29.72"),
+        ],
+        [(topics.storage_total, "29.72")],
+    ]
+
+
+def test_storage_health():
+    camera = make_camera()
+    assert read_storage_health(camera) == {"storage_health": OFF}
+
+    camera.client.storage_device_info = STORAGE_INFO.replace("Success", "Error")
+    assert read_storage_health(camera) == {"storage_health": ON}
+
+    camera.client.storage_device_info = ""
+    assert read_storage_health(camera) == {"storage_health": ON}
+
+
+def test_every_sensor_entity_has_a_topic():
+    topics = Topics.for_camera(make_camera(), "homeassistant")
+    for spec in SENSORS:
+        for entity in spec.entities:
+            assert topics[entity]
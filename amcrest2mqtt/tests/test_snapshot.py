@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.snapshot import SnapshotFetcher
+
+
+class FakeAmcrest:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.release = threading.Event()
+
+    def snapshot(self, stream: bool = True) -> bytes:
+        self.calls += 1
+        self.release.wait(1)
+        return b"\xff\xd8jpeg"
+
+
+def test_triggers_are_merged_into_running_fetch():
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.client = FakeAmcrest()
+    published = []
+
+    async def run() -> None:
+        snapshots = SnapshotFetcher(camera, published.append)
+        first = snapshots.trigger()
+        assert snapshots.trigger() is first
+
+        camera.client.release.set()
+        assert await first == b"\xff\xd8jpeg"
+
+        await snapshots.trigger()
+
+    asyncio.run(run())
+    assert camera.client.calls == 2
+    assert published == [b"\xff\xd8jpeg", b"\xff\xd8jpeg"]
+
+
+def test_fresh_snapshot_is_served_from_cache():
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.client = FakeAmcrest()
+    camera.client.release.set()
+    published = []
+
+    async def run() -> None:
+        snapshots = SnapshotFetcher(camera, published.append, max_age=0.1)
+        await snapshots.trigger()
+        assert snapshots.latest == b"\xff\xd8jpeg"
+
+        # Published again without asking the camera
+        assert await snapshots.get() == b"\xff\xd8jpeg"
+        snapshots.republish()
+        assert camera.client.calls == 1
+        assert len(published) == 3
+
+        await asyncio.sleep(0.1)
+        snapshots.republish()
+        assert len(published) == 3
+        await snapshots.get()
+        assert camera.client.calls == 2
+
+    asyncio.run(run())
@@ -0,0 +1,88 @@
+import sqlite3
+import time
+
+from amcrest2mqtt.spool import Spool
+
+
+def test_spool_is_fifo(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    for index in range(3):
+        spool.append("topic", f"{index}".encode())
+
+    rows = spool.peek(limit=2)
+    assert [row.payload for row in rows] == [b"0", b"1"]
+    # Messages stay spooled until removed
+    assert spool.peek(limit=2) == rows
+
+    spool.remove([row.id for row in rows])
+    assert [row.payload for row in spool.peek()] == [b"2"]
+
+
+def test_spool_survives_restart(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"))
+    spool.append("topic", b"event", 1, "application/msgpack", [("camera", "front")])
+    spool.flush()
+
+    (row,) = Spool(str(tmp_path / "spool.db")).peek()
+    assert (row.topic, row.payload, row.qos) == ("topic", b"event", 1)
+    assert row.content_type == "application/msgpack"
+    assert row.user_properties == [("camera", "front")]
+
+
+def test_spool_adds_columns_to_older_spools(tmp_path):
+    path = str(tmp_path / "spool.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "created REAL NOT NULL, topic TEXT NOT NULL, payload BLOB, "
+        "qos INTEGER NOT NULL)"
+    )
+    db.execute(
+        "INSERT INTO messages (created, topic, payload, qos) VALUES (?, ?, ?, ?)",
+        (time.time(), "topic", b"old", 0),
+    )
+    db.commit()
+    db.close()
+
+    spool = Spool(path)
+    spool.append("topic", b"new", content_type="application/cbor")
+    assert [(row.payload, row.content_type) for row in spool.peek()] == [
+        (b"old", None),
+        (b"new", "application/cbor"),
+    ]
+
+
+def test_spool_evicts_oldest(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"), max_bytes=250)
+    for index in range(5):
+        spool.append("topic", bytes([index]) * 100)
+    spool.flush()
+
+    assert [row.payload[0] for row in spool.peek()] == [3, 4]
+
+
+def test_spool_evicts_expired(tmp_path):
+    spool = Spool(str(tmp_path / "spool.db"), max_age=0.01)
+    spool.append("topic", b"event")
+    spool.flush()
+    time.sleep(0.02)
+
+    assert spool.peek() == []
+
+
+def test_spool_tracks_its_size(tmp_path):
+    path = str(tmp_path / "spool.db")
+    spool = Spool(path, max_bytes=250)
+    # The first message is evicted, the second delivered
+    for index in range(3):
+        spool.append("topic", bytes([index]) * 100)
+    spool.flush()
+    spool.remove([spool.peek(limit=1)[0].id])
+
+    # Sized from the disk when reopened, then kept up to date
+    spool = Spool(path, max_bytes=250)
+    assert spool._size == 100
+    spool.append("topic", "é" * 100)
+    spool.flush()
+    assert [row.payload[0] for row in spool.peek()] == [2, "é"]
+    assert spool._size == 200
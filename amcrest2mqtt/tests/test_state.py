@@ -0,0 +1,74 @@
+import asyncio
+from concurrent.futures import Future
+
+from amcrest2mqtt.mqtt import MqttPublishError
+from amcrest2mqtt.state import StateTracker
+from amcrest2mqtt.topics import OFF, ON
+from amcrest2mqtt.tracing import EventTrace
+
+
+def test_only_transitions_are_published():
+    published = []
+    tracker = StateTracker(publish=lambda topic, state: published.append(state))
+
+    async def run() -> None:
+        for state in [ON, ON, OFF, OFF, ON]:
+            tracker.update("motion", state)
+
+    asyncio.run(run())
+    assert published == [ON, OFF, ON]
+
+
+def test_off_delay_collapses_flapping():
+    published = []
+    tracker = StateTracker(
+        publish=lambda topic, state: published.append(state),
+        off_delays={"motion": 0.05},
+    )
+
+    async def run() -> None:
+        tracker.update("motion", ON)
+        tracker.update("motion", OFF)
+        tracker.update("motion", ON)
+        tracker.update("motion", OFF)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert published == [ON, OFF]
+
+
+def test_failed_publish_is_published_again():
+    futures = []
+
+    def publish(topic: str, state: str) -> Future:
+        futures.append(Future())
+        return futures[-1]
+
+    tracker = StateTracker(publish=publish)
+
+    async def run() -> None:
+        tracker.update("motion", ON)
+        futures[0].set_exception(MqttPublishError(4))
+        await asyncio.sleep(0.01)
+        tracker.update("motion", ON)
+        futures[1].set_result(1)
+        await asyncio.sleep(0.01)
+        tracker.update("motion", ON)
+
+    asyncio.run(run())
+    assert len(futures) == 2
+
+
+def test_trace_is_passed_on():
+    published = []
+    tracker = StateTracker(
+        publish=lambda topic, state, trace=None: published.append((state, trace))
+    )
+    trace = EventTrace()
+
+    async def run() -> None:
+        tracker.update("motion", ON, trace)
+        tracker.update("motion", OFF)
+
+    asyncio.run(run())
+    assert published == [(ON, trace), (OFF, None)]
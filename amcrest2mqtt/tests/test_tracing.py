@@ -0,0 +1,10 @@
+from amcrest2mqtt.tracing import EventTrace
+
+
+def test_as_fields():
+    trace = EventTrace()
+    assert trace.mark_routed() >= 0
+
+    fields = trace.as_fields()
+    assert set(fields) == {"received_at", "route_ms", "publish_ms"}
+    assert fields["publish_ms"] >= fields["route_ms"]
@@ -1,5 +1,15 @@
-from amcrest2mqtt.util import to_gb
+from amcrest2mqtt.util import Backoff, to_gb
 
 
 def test_to_gb() -> str:
     assert "37.25" == to_gb(40000000000)
+
+
+def test_backoff() -> None:
+    backoff = Backoff(initial=1, maximum=8)
+    delays = [backoff.next() for _ in range(5)]
+    assert 0.5 <= delays[0] <= 1
+    assert 4 <= delays[4] <= 8
+
+    backoff.reset()
+    assert backoff.next() <= 1
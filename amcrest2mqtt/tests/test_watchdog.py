@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+from amcrest import AmcrestError
+from amcrest.exceptions import CommError
+
+from amcrest2mqtt.camera import CameraClient
+from amcrest2mqtt.watchdog import EventWatchdog
+
+EVENT = ("VideoMotion", {"Code": "VideoMotion", "action": "Start"})
+
+
+class FakeAmcrest:
+    def __init__(self) -> None:
+        self.probes = 0
+        self.answering = True
+
+    async def async_command(self, cmd: str, retries=None, timeout_cmd=None) -> str:
+        self.probes += 1
+        if not self.answering:
+            raise CommError("Connection timed out")
+        return "result=2024-01-01 00:00:00"
+
+
+def make_camera() -> CameraClient:
+    camera = CameraClient("127.0.0.1", "80", "admin", "password")
+    camera.client = FakeAmcrest()
+    return camera
+
+
+def test_silent_stream_is_reopened():
+    camera = make_camera()
+    subscriptions = []
+
+    async def subscribe():
+        subscriptions.append(True)
+        yield EVENT
+        # A stream which hangs without closing
+        await asyncio.Event().wait()
+
+    async def run():
+        watchdog = EventWatchdog(
+            camera, subscribe, interval=0.01, timeout=1, resubscribe_after=0.05
+        )
+        events = watchdog.events()
+        assert await anext(events) == EVENT
+        assert await anext(events) == EVENT
+        await events.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(subscriptions) == 2
+    assert camera.client.probes >= 2
+
+
+def test_failed_probe_ends_stream():
+    camera = make_camera()
+    camera.client.answering = False
+    closed = []
+
+    async def subscribe():
+        try:
+            yield EVENT
+            await asyncio.Event().wait()
+        finally:
+            closed.append(True)
+
+    async def run():
+        events = EventWatchdog(camera, subscribe, interval=0.01, timeout=1).events()
+        assert await anext(events) == EVENT
+        with pytest.raises(AmcrestError, match="stopped answering"):
+            await anext(events)
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert camera.client.probes == 1
+    assert closed == [True]
+
+
+def test_event_arriving_after_probe_is_kept():
+    camera = make_camera()
+    subscriptions = []
+    arrived = None
+
+    async def probe(timeout: float) -> None:
+        # Answers as the silent stream's next event arrives
+        arrived.set_result(EVENT)
+
+    camera.probe = probe
+
+    async def subscribe():
+        subscriptions.append(True)
+        yield EVENT
+        yield await arrived
+        await asyncio.Event().wait()
+
+    async def run():
+        nonlocal arrived
+        arrived = asyncio.get_running_loop().create_future()
+        watchdog = EventWatchdog(
+            camera, subscribe, interval=0.01, timeout=1, resubscribe_after=0.01
+        )
+        events = watchdog.events()
+        assert await anext(events) == EVENT
+        assert await anext(events) == EVENT
+        await events.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert len(subscriptions) == 1
+
+
+def test_stream_end_ends_events():
+    async def subscribe():
+        yield EVENT
+
+    async def run():
+        events = EventWatchdog(make_camera(), subscribe, interval=1, timeout=1)
+        return [event async for event in events.events()]
+
+    assert asyncio.run(run()) == [EVENT]
+
+
+def test_events_keep_stream_alive():
+    camera = make_camera()
+
+    async def subscribe():
+        for _ in range(20):
+            await asyncio.sleep(0.005)
+            yield EVENT
+
+    async def run():
+        watchdog = EventWatchdog(
+            camera, subscribe, interval=0.05, timeout=1, resubscribe_after=0.05
+        )
+        return [event async for event in watchdog.events()]
+
+    assert len(asyncio.run(run())) == 20
+    assert camera.client.probes == 0